@@ -0,0 +1,73 @@
+import os
+import shutil
+import sys
+import utils
+from report import Reporter
+
+
+class BatchApp(utils.RunApp):
+    """
+    headless RunApp \n
+    the folder comes from the command line, no window is opened and every match is accepted,
+    reported, then deleted or moved unless dry_run is set. With groups, the groups of duplicates
+    are reported once the search is over instead of every pair as it is found.
+    """
+    def __init__(self, mode, reporter: Reporter, action: str | None = None, target: str | None = None,
+                 dry_run: bool = False, groups: bool = False, **kwargs):
+        super().__init__(mode, **kwargs)
+        self.reporter = reporter
+        # None only reports, "delete" removes duplicates, "move" moves them into target
+        self.action = action
+        self.target = target
+        self.dry_run = dry_run
+        self.report_groups = groups
+        # duplicates found by the current search
+        self.found: list[str] = []
+
+    def get_path(self):
+        if not self.path:
+            self.fail("No directory specified !")
+        super().get_path()
+
+    def fail(self, msg: str) -> None:
+        raise SystemExit(msg)
+
+    def review(self, keep: utils.File, dup: utils.File, score: float, exact: bool = False) -> bool:
+        done = "none"
+        if self.action is not None:
+            done = "dry-run" if self.dry_run else self.apply(dup.ret_name())
+        if not self.report_groups:
+            self.reporter.pair(keep.ret_name(), dup.ret_name(), "exact" if exact else self.mode, score, done)
+        self.found.append(dup.ret_name())
+        return True
+
+    def drive(self, job) -> None:
+        self.found = []
+        super().drive(job)
+        if self.report_groups:
+            # with an update, only the groups that grew are reported
+            for group in self.clusters.groups(self.found):
+                self.reporter.group(group)
+
+    def apply(self, name: str) -> str:
+        """
+        deletes or moves a duplicate, an error is reported instead of stopping the batch
+
+        :returns the action performed
+        """
+        try:
+            if self.action == "delete":
+                os.remove(name)
+                return "deleted"
+            os.makedirs(self.target, exist_ok = True)
+            dest = os.path.join(self.target, os.path.basename(name))
+            base, ext = os.path.splitext(dest)
+            n = 1
+            while os.path.exists(dest):
+                dest = f"{base}_{n}{ext}"
+                n += 1
+            shutil.move(name, dest)
+            return "moved"
+        except OSError as e:
+            print(f"could not {self.action} {name} : {e}", file = sys.stderr)
+            return "error"
@@ -0,0 +1,299 @@
+import argparse as ap
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from PIL import Image, ImageDraw, ImageEnhance
+import numpy as np
+import utils
+import batch
+import hashindex
+from report import Reporter
+
+SIZES = [(640, 480), (800, 600), (1024, 768), (600, 600), (480, 640)]
+FORMATS = [".jpg", ".png", ".bmp"]
+# largest growth exponent of the lookup time with the index size, 1 is a lookup linear in the index
+MAX_SCALING = 1.2
+
+
+def base_image(rng: np.random.Generator, size: tuple) -> Image.Image:
+    """
+    draws a random picture : a two colour gradient with a few ellipses and rectangles on top
+    """
+    w, h = size
+    c1, c2 = rng.integers(0, 256, 3), rng.integers(0, 256, 3)
+    t = np.linspace(0, 1, w)[None, :, None] * rng.random() + np.linspace(0, 1, h)[:, None, None] * (1 - rng.random())
+    t = t / t.max()
+    pixels = (c1 * (1 - t) + c2 * t).astype(np.uint8)
+    img = Image.fromarray(pixels, mode = "RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(int(rng.integers(3, 9))):
+        x0, y0 = int(rng.integers(0, w - 20)), int(rng.integers(0, h - 20))
+        x1, y1 = int(rng.integers(x0 + 10, w)), int(rng.integers(y0 + 10, h))
+        colour = tuple(int(c) for c in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            draw.ellipse((x0, y0, x1, y1), fill = colour)
+        else:
+            draw.rectangle((x0, y0, x1, y1), fill = colour)
+    return img
+
+def variant(rng: np.random.Generator, img: Image.Image, kind: str) -> Image.Image:
+    """
+    near-duplicate of img : "reencode" (JPEG at a lower quality), "resize" (half size) or "shift" (colour shift)
+    """
+    if kind == "reencode":
+        buf = io.BytesIO()
+        img.save(buf, format = "JPEG", quality = int(rng.integers(60, 90)))
+        buf.seek(0)
+        return Image.open(buf).convert("RGB")
+    if kind == "resize":
+        return img.resize((img.width // 2, img.height // 2))
+    return ImageEnhance.Brightness(img).enhance(1 + float(rng.uniform(-0.03, 0.03)))
+
+def make_corpus(folder: str, n: int, seed: int = 0) -> list[list[str]]:
+    """
+    writes n reproducible images into folder : unrelated pictures and near-duplicates of some of them
+
+    :returns the groups of file names that are duplicates of each other (single files included)
+    """
+    rng = np.random.default_rng(seed)
+    groups = []
+    count = 0
+    while count < n:
+        img = base_image(rng, SIZES[int(rng.integers(len(SIZES)))])
+        group = []
+        copies = 1 if rng.random() < 0.5 else int(rng.integers(2, 4))
+        for c in range(min(copies, n - count)):
+            out = img if c == 0 else variant(rng, img, ["reencode", "resize", "shift"][int(rng.integers(3))])
+            name = os.path.join(folder, f"img_{count:05d}{FORMATS[int(rng.integers(len(FORMATS)))]}")
+            out.save(name)
+            group.append(name)
+            count += 1
+        groups.append(group)
+    return groups
+
+def accuracy(groups: list[list[str]], pairs: list[tuple]) -> tuple:
+    """
+    precision : share of reported pairs that belong to the same group,
+    recall : share of duplicate pairs of the corpus that ended in the same reported cluster
+
+    :returns (precision, recall)
+    """
+    truth = {name: k for k, group in enumerate(groups) for name in group}
+    parent = {}
+    def find(x):
+        while parent.get(x, x) != x:
+            x = parent[x]
+        return x
+    for a, b in pairs:
+        parent[find(a)] = find(b)
+
+    correct = sum(truth[a] == truth[b] for a, b in pairs)
+    found, total = 0, 0
+    for group in groups:
+        for i in range(len(group)):
+            for j in range(i + 1, len(group)):
+                total += 1
+                found += find(group[i]) == find(group[j])
+    precision = correct / len(pairs) if pairs else 1.0
+    recall = found / total if total else 1.0
+    return precision, recall
+
+def timed(fn, repeat: int = 1) -> tuple:
+    """
+    :returns (best time out of repeat runs, result of the last run)
+    """
+    best, res = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, res
+
+def bench_size(folder: str, n: int, groups: list[list[str]], modes: list[str], repeat: int) -> tuple:
+    """
+    times every stage on a corpus of n images
+
+    :returns (stage timings, accuracy) as lists of dicts
+    """
+    runs, scores = [], []
+    def record(stage, seconds, items):
+        runs.append({"size": n, "stage": stage, "seconds": round(seconds, 6), "items": items})
+
+    fol = utils.Folder(folder)
+    t, files = timed(lambda: list(fol.scan()), repeat)
+    record("enumerate", t, len(files))
+
+    for mode in modes:
+        app = utils.RunApp(mode, hash_dist = None)
+        app.folder = fol
+        t, sigs = timed(lambda: [app.signature(utils.File(f.ret_name())) for f in files], repeat)
+        record(f"signature_{mode}", t, len(files))
+
+        def end_to_end():
+            out = io.StringIO()
+            run = batch.BatchApp(mode, Reporter(out), path = folder)
+            run.run()
+            return [json.loads(line) for line in out.getvalue().splitlines()], run.metrics.summary()
+        t, (found, summary) = timed(end_to_end, repeat)
+        # comparisons as the search runs them, through compare_all : size buckets, early exit and cascade
+        compare = summary["stages"].get("compare", {"seconds": 0.0})
+        record(f"compare_{mode}", compare["seconds"], summary["counters"].get("comparisons", 0))
+        record(f"end_to_end_{mode}", t, len(files))
+        precision, recall = accuracy(groups, [(r["keep"], r["duplicate"]) for r in found])
+        scores.append({"size": n, "mode": mode, "precision": round(precision, 4), "recall": round(recall, 4)})
+    return runs, scores
+
+def bench_index(sizes: list[int], seed: int, queries: int = 200) -> list[dict]:
+    """
+    times hashindex lookups within DEFAULT_DIST on indexes of random 64 bits hashes, which spread like the hashes
+    of unrelated images (32 bits apart on average), half of the lookups being near copies of indexed hashes
+
+    :returns stage timings, the seconds of all the lookups on an index of each size
+    """
+    rng = random.Random(seed)
+    runs = []
+    for n in sizes:
+        hashes = [rng.getrandbits(64) for _ in range(n)]
+        index = hashindex.MultiIndex(hashindex.DEFAULT_DIST)
+        for i, h in enumerate(hashes):
+            index.add(h, i)
+        probes = []
+        for q in range(queries):
+            h = hashes[rng.randrange(n)] if q % 2 == 0 else rng.getrandbits(64)
+            for _ in range(3):
+                h ^= 1 << rng.randrange(64)
+            probes.append(h)
+        t, _ = timed(lambda: [index.query(h, hashindex.DEFAULT_DIST) for h in probes])
+        runs.append({"size": n, "stage": "index_query", "seconds": round(t, 6), "items": queries})
+    return runs
+
+def scaling(runs: list[dict]) -> list[str]:
+    """
+    checks that a lookup grows slower than the index, the search would turn quadratic else
+
+    :returns a description of the problem, if any
+    """
+    points = sorted((r["size"], r["seconds"]) for r in runs if r["stage"] == "index_query")
+    if len(points) < 2 or points[0][1] <= 0:
+        return []
+    (n0, t0), (n1, t1) = points[0], points[-1]
+    exponent = np.log(t1 / t0) / np.log(n1 / n0)
+    if exponent > MAX_SCALING:
+        return [f"index lookups grow as size^{exponent:.2f} from {n0} to {n1} hashes (at most {MAX_SCALING})"]
+    return []
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    compares results with a previous run, a stage slower by more than tolerance (and by more than 5ms, below
+    which timings are noise) or an accuracy lower by more than 0.01 is a regression
+
+    :returns a description of every regression
+    """
+    res = []
+    old_runs = {(r["size"], r["stage"]): r for r in baseline.get("runs", [])}
+    for r in results["runs"]:
+        old = old_runs.get((r["size"], r["stage"]))
+        if old is not None and r["seconds"] > old["seconds"] * (1 + tolerance) and r["seconds"] - old["seconds"] > 0.005:
+            res.append(f"{r['stage']} on {r['size']} images : {old['seconds']:.3f}s -> {r['seconds']:.3f}s")
+    old_scores = {(s["size"], s["mode"]): s for s in baseline.get("accuracy", [])}
+    for s in results["accuracy"]:
+        old = old_scores.get((s["size"], s["mode"]))
+        for key in ("precision", "recall"):
+            if old is not None and s[key] < old[key] - 0.01:
+                res.append(f"{key} of {s['mode']} on {s['size']} images : {old[key]} -> {s[key]}")
+    return res
+
+def parse_argument():
+    pars = ap.ArgumentParser(description = "Times every stage of Duplikate on a synthetic corpus")
+    pars.add_argument(
+        "--sizes", type = int, nargs = "+", default = [20, 40, 80],
+        help = "Corpus sizes to run, in images (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--index-sizes", type = int, nargs = "*", default = [5000, 20000, 80000],
+        help = "Hash index sizes of the lookup scaling check, none to skip it (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--modes", nargs = "+", choices = ["F", "A"], default = ["F", "A"],
+        help = "Search modes to run (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--seed", type = int, default = 0,
+        help = "Seed of the corpus generator (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--repeat", type = int, default = 1,
+        help = "Runs per stage, the best time is kept (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "-o", "--output",
+        help = "JSON results file (default: stdout)"
+    )
+
+    pars.add_argument(
+        "--baseline",
+        help = "Previous JSON results to compare with, regressions make the exit status 1"
+    )
+
+    pars.add_argument(
+        "--tolerance", type = float, default = 0.2,
+        help = "Slowdown allowed against the baseline before a stage is flagged (default: %(default)s)"
+    )
+    return pars.parse_args()
+
+if __name__ == "__main__":
+    args = parse_argument()
+    results = {
+        "meta": {
+            "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+            "seed": args.seed, "time": time.strftime("%Y-%m-%dT%H:%M:%S")
+        },
+        "runs": [], "accuracy": []
+    }
+
+    for n in args.sizes:
+        folder = tempfile.mkdtemp(prefix = "duplikate_bench_")
+        try:
+            groups = make_corpus(folder, n, args.seed)
+            runs, scores = bench_size(folder, n, groups, args.modes, args.repeat)
+        finally:
+            shutil.rmtree(folder, ignore_errors = True)
+        results["runs"].extend(runs)
+        results["accuracy"].extend(scores)
+        for r in runs:
+            print(f"{n:>6} {r['stage']:<16} {r['seconds']:>10.3f}s {r['items']:>8}", file = sys.stderr)
+        for s in scores:
+            print(f"{n:>6} accuracy {s['mode']}       precision {s['precision']:.3f}  recall {s['recall']:.3f}", file = sys.stderr)
+
+    runs = bench_index(args.index_sizes, args.seed)
+    results["runs"].extend(runs)
+    for r in runs:
+        print(f"{r['size']:>6} {r['stage']:<16} {r['seconds']:>10.3f}s {r['items']:>8}", file = sys.stderr)
+    found = scaling(runs)
+
+    text = json.dumps(results, indent = 2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            found += regressions(results, json.load(f), args.tolerance)
+    for line in found:
+        print("REGRESSION " + line, file = sys.stderr)
+    if found:
+        raise SystemExit(1)
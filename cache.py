@@ -0,0 +1,160 @@
+import io
+import os
+import sqlite3
+import time
+import numpy as np
+import region
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "duplikate", "signatures.sqlite")
+DEFAULT_SIZE = 512 * 1024 * 1024
+# eviction goes down to this share of max_bytes, so that the next puts don't evict again
+LOW_WATER = 0.9
+EVICT_BATCH = 256
+
+
+def encode(kind: str, sig) -> bytes:
+    """
+    serializes a signature : a .npy conv grid, or the .npz (labels, avgs) pair of Region.to_labels for regions
+    """
+    buf = io.BytesIO()
+    if kind.startswith("regions"):
+        labels, avgs = region.Region.to_labels(sig, (sig[0].dims[1], sig[0].dims[0]))
+        np.savez(buf, labels = labels, avgs = avgs)
+    else:
+        np.save(buf, np.asarray(sig))
+    return buf.getvalue()
+
+def decode(kind: str, data: bytes):
+    buf = io.BytesIO(data)
+    if kind.startswith("regions"):
+        with np.load(buf) as packed:
+            return region.Region.from_labels(packed["labels"], packed["avgs"])
+    return np.load(buf)
+
+
+class SignatureCache:
+    """
+    on-disk store of the signatures computed by RunApp \n
+    entries are keyed by absolute path, signature kind ("conv" or "regions",
+    "-reduced" suffixed for reduced decoding) and buffer,
+    and are only returned while the file keeps the byte size and mtime it had when stored
+    """
+    def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = DEFAULT_SIZE) -> None:
+        self.__path = path
+        self.__max_bytes = max_bytes
+        self.__pending = 0
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        # the search may run on another thread than the one that opened the store, never on two at once
+        self.__db = sqlite3.connect(path, check_same_thread = False)
+        self.__db.execute("PRAGMA journal_mode = WAL")
+        self.__db.execute("PRAGMA synchronous = NORMAL")
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            "path TEXT, kind TEXT, buffer INTEGER, size INTEGER, mtime INTEGER, "
+            "nbytes INTEGER, last_used REAL, data BLOB, PRIMARY KEY (path, kind, buffer))"
+        )
+        self.__db.execute("CREATE INDEX IF NOT EXISTS signatures_last_used ON signatures (last_used)")
+        self.__total = self.__db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM signatures").fetchone()[0]
+
+    def ret_path(self):
+        return self.__path
+
+    def ret_total(self):
+        return self.__total
+
+    def stat_key(self, name: str, st: os.stat_result | None = None) -> tuple:
+        """
+        :returns (absolute path, byte size, mtime in ns) of a file, st saves the stat call when already known
+        """
+        if st is None:
+            st = os.stat(name)
+        return os.path.abspath(name), st.st_size, st.st_mtime_ns
+
+    def get(self, name: str, kind: str, buffer: int, st: os.stat_result | None = None):
+        """
+        looks up the signature of an image \n
+        an entry whose size or mtime no longer matches the file is dropped
+
+        :returns the signature (conv array or list of regions), None if missing or stale
+        """
+        path, size, mtime = self.stat_key(name, st)
+        row = self.__db.execute(
+            "SELECT size, mtime, nbytes, data FROM signatures WHERE path = ? AND kind = ? AND buffer = ?",
+            (path, kind, buffer)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[0] != size or row[1] != mtime:
+            self.__db.execute(
+                "DELETE FROM signatures WHERE path = ? AND kind = ? AND buffer = ?", (path, kind, buffer)
+            )
+            self.__total -= row[2]
+            self.__touch()
+            return None
+        self.__db.execute(
+            "UPDATE signatures SET last_used = ? WHERE path = ? AND kind = ? AND buffer = ?",
+            (time.time(), path, kind, buffer)
+        )
+        self.__touch()
+        return self.decode(kind, row[3])
+
+    def put(self, name: str, kind: str, buffer: int, sig, st: os.stat_result | None = None) -> None:
+        """
+        stores the signature of an image, evicting the least recently used entries above max_bytes
+        """
+        path, size, mtime = self.stat_key(name, st)
+        data = self.encode(kind, sig)
+        old = self.__db.execute(
+            "SELECT nbytes FROM signatures WHERE path = ? AND kind = ? AND buffer = ?", (path, kind, buffer)
+        ).fetchone()
+        if old is not None:
+            self.__total -= old[0]
+        self.__db.execute(
+            "INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, kind, buffer, size, mtime, len(data), time.time(), data)
+        )
+        self.__total += len(data)
+        if self.__total > self.__max_bytes:
+            self.evict()
+        self.__touch()
+
+    def evict(self) -> None:
+        """
+        deletes the least recently used entries, EVICT_BATCH at a time, until the store fits
+        in LOW_WATER * max_bytes
+        """
+        target = self.__max_bytes * LOW_WATER
+        while self.__total > target:
+            rows = self.__db.execute(
+                "SELECT rowid, nbytes FROM signatures ORDER BY last_used LIMIT ?", (EVICT_BATCH,)
+            ).fetchall()
+            if not rows:
+                break
+            drop = []
+            for rowid, nbytes in rows:
+                if self.__total <= target:
+                    break
+                drop.append((rowid,))
+                self.__total -= nbytes
+            self.__db.executemany("DELETE FROM signatures WHERE rowid = ?", drop)
+
+    def encode(self, kind: str, sig) -> bytes:
+        return encode(kind, sig)
+
+    def decode(self, kind: str, data: bytes):
+        return decode(kind, data)
+
+    def __touch(self) -> None:
+        # commits are batched, a crash only loses the last few entries
+        self.__pending += 1
+        if self.__pending >= 64:
+            self.flush()
+
+    def flush(self) -> None:
+        self.__db.commit()
+        self.__pending = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.__db.close()
@@ -0,0 +1,62 @@
+import numpy as np
+import region
+import signature
+
+STAGES = ["count", "colour", "aspect", "grid"]
+# the stages that only prune pairs accurate_find would reject anyway
+DEFAULT = ["count", "colour"]
+COARSE = 4
+
+
+class Cascade:
+    """
+    cheap filters run in order in front of accurate_find, each one pruning pairs that can't be a match \n
+    accurate_find subtracts non-negative terms from its region-count penalty, so any partial sum bounds the score :
+    "count" prunes on the penalty alone, "colour" adds the colour terms, which only need the region averages.
+    Both are exact, a pair they prune always scores at most min_score. "aspect" (relative difference of the
+    aspect ratios above max_aspect) and "grid" (mean difference of the COARSE x COARSE grids of region colours
+    above max_grid, on the 0-255 scale) are heuristics, to be turned on when a looser search is acceptable.
+    """
+    def __init__(self, stages: list[str] = DEFAULT, min_score: float = -1.0, max_aspect: float = 0.1,
+                 max_grid: float = 40.0) -> None:
+        for stage in stages:
+            if stage not in STAGES:
+                raise ValueError(f"unknown cascade stage {stage}, expected one of {', '.join(STAGES)}")
+        self.stages = list(stages)
+        self.min_score = min_score
+        self.max_aspect = max_aspect
+        self.max_grid = max_grid
+
+    def coarse(rgs: list[region.Region]) -> np.ndarray:
+        """
+        :returns the (COARSE, COARSE, 3) grid of the region colours painted back over the image
+        """
+        labels, avgs = region.Region.to_labels(rgs, (rgs[0].dims[1], rgs[0].dims[0]))
+        return signature.resample(avgs[labels], COARSE).astype(np.float32)
+
+    def check(self, rgs1: region.RegionSet, rgs2: region.RegionSet, grid1 = None, grid2 = None) -> tuple:
+        """
+        runs the stages on a pair, in the argument order of accurate_find
+
+        :returns (None, None) if the pair goes through, else (stage that pruned it, upper bound of its score,
+        -inf for the heuristic stages)
+        """
+        pen = abs(len(rgs1) - len(rgs2)) * -0.1
+        for stage in self.stages:
+            if stage == "count":
+                if round(pen, 3) <= self.min_score:
+                    return stage, round(pen, 3)
+            elif stage == "colour":
+                nbr_comp = min(len(rgs1), len(rgs2))
+                sums = np.abs(rgs1.ret_avgs()[:nbr_comp].sum(axis = 0) - rgs2.ret_avgs()[:nbr_comp].sum(axis = 0))
+                bound = round(float(pen - (sums / (100 * nbr_comp)).sum()), 3)
+                if bound <= self.min_score:
+                    return stage, bound
+            elif stage == "aspect":
+                a1, a2 = rgs1.dims[0] / rgs1.dims[1], rgs2.dims[0] / rgs2.dims[1]
+                if abs(a1 - a2) / max(a1, a2) > self.max_aspect:
+                    return stage, float("-inf")
+            elif stage == "grid" and grid1 is not None and grid2 is not None:
+                if float(np.abs(np.asarray(grid1, dtype = np.float64) - grid2).mean()) > self.max_grid:
+                    return stage, float("-inf")
+        return None, None
@@ -0,0 +1,61 @@
+class Clusters:
+    """
+    union-find over file names \n
+    every group of duplicates has one representative, the file kept : unions always hang the duplicate's
+    group under the kept file's one, and later comparisons only need to run against representatives
+    """
+    def __init__(self) -> None:
+        self.__parent: dict[str, str] = {}
+        # members of every group, representatives only, in the order they joined
+        self.__members: dict[str, list[str]] = {}
+
+    def __len__(self):
+        return len(self.__parent)
+
+    def find(self, name: str) -> str:
+        """
+        :returns the representative of the group of name, name itself if it never joined one
+        """
+        root = name
+        while self.__parent.get(root, root) != root:
+            root = self.__parent[root]
+        # path compression, the next lookups of every name on the way are direct
+        while name != root:
+            self.__parent[name], name = root, self.__parent[name]
+        return root
+
+    def union(self, keep: str, dup: str) -> str:
+        """
+        merges the group of dup into the group of keep
+
+        :returns the representative of the merged group
+        """
+        root, other = self.find(keep), self.find(dup)
+        if root == other:
+            return root
+        self.__parent.setdefault(root, root)
+        self.__parent[other] = root
+        members = self.__members.setdefault(root, [root])
+        members.extend(self.__members.pop(other, [other]))
+        return root
+
+    def split(self, name: str) -> None:
+        """
+        takes name out of its group again, name must not be the representative of a group with other members
+        """
+        root = self.find(name)
+        if root == name:
+            return
+        self.__parent[name] = name
+        self.__members[root].remove(name)
+        if len(self.__members[root]) == 1:
+            del self.__members[root]
+
+    def groups(self, names = None) -> list[list[str]]:
+        """
+        :returns every group of more than one file, representative first, only the groups holding one of names if given
+        """
+        if names is None:
+            return [list(members) for members in self.__members.values()]
+        roots = dict.fromkeys(self.find(name) for name in names)
+        return [list(self.__members[root]) for root in roots if root in self.__members]
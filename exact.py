@@ -0,0 +1,77 @@
+import hashlib
+import os
+
+HEAD = 65536
+
+
+def file_hash(name: str, limit: int | None = None, chunk: int = 1 << 20) -> bytes:
+    """
+    hashes a file by streaming it, only its first limit bytes if limit is given
+    """
+    h = hashlib.blake2b(digest_size = 16)
+    left = limit
+    with open(name, "rb") as f:
+        while left is None or left > 0:
+            data = f.read(chunk if left is None else min(chunk, left))
+            if not data:
+                break
+            h.update(data)
+            if left is not None:
+                left -= len(data)
+    return h.digest()
+
+
+class ExactIndex:
+    """
+    finds byte-identical files as they are scanned, without decoding them \n
+    a file is only hashed once another file of the same byte size shows up, first on its head bytes,
+    then on its whole content if the heads match
+    """
+    def __init__(self, head: int = HEAD) -> None:
+        self.__head = head
+        self.__by_size: dict[int, list[str]] = {}
+        self.__heads: dict[str, bytes] = {}
+        self.__fulls: dict[str, bytes] = {}
+
+    def head_hash(self, name: str) -> bytes:
+        if name not in self.__heads:
+            self.__heads[name] = file_hash(name, self.__head)
+        return self.__heads[name]
+
+    def full_hash(self, name: str) -> bytes:
+        if name not in self.__fulls:
+            self.__fulls[name] = file_hash(name)
+        return self.__fulls[name]
+
+    def add(self, name: str, size: int) -> str | None:
+        """
+        indexes a file unless an earlier indexed file has the same content
+
+        :returns the name of that earlier file, None if the file is new
+        """
+        peers = self.__by_size.setdefault(size, [])
+        try:
+            for peer in peers:
+                # the same file reached twice, through another path or a hard link, is no copy of itself
+                if peer == name or self.head_hash(peer) != self.head_hash(name) or os.path.samefile(peer, name):
+                    continue
+                # the head hash already covers small files entirely
+                if size <= self.__head or self.full_hash(peer) == self.full_hash(name):
+                    return peer
+        except OSError:
+            return None
+        peers.append(name)
+        return None
+
+    def known(self, name: str, size: int) -> None:
+        """
+        indexes a file already known to differ from every indexed file, without hashing it
+        """
+        self.__by_size.setdefault(size, []).append(name)
+
+    def remove(self, name: str, size: int) -> None:
+        peers = self.__by_size.get(size, [])
+        if name in peers:
+            peers.remove(name)
+        self.__heads.pop(name, None)
+        self.__fulls.pop(name, None)
@@ -0,0 +1,83 @@
+import numpy as np
+import signature
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+# near duplicates land within a few bits, unrelated images around 32
+DEFAULT_DIST = 10
+
+
+def dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * x + 1) * k / (2 * n))
+
+DCT = dct_matrix(DCT_SIZE)
+
+def phash(grid: np.ndarray) -> int:
+    """
+    reduces a (h, w, 3) grid of block averages to a 64 bits perceptual hash \n
+    the grid is turned to luminance, resampled to 32x32, and the 8x8 lowest DCT frequencies
+    are compared to their median
+
+    :returns the hash as an int
+    """
+    gray = np.asarray(grid, dtype = np.float64)[:, :, :3] @ np.array([0.299, 0.587, 0.114])
+    low = (DCT @ signature.resample(gray, DCT_SIZE) @ DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hamming(h1: int, h2: int) -> int:
+    return (h1 ^ h2).bit_count()
+
+
+class MultiIndex:
+    """
+    multi-index hashing over hamming distance \n
+    the 64 bits are split into radius + 1 disjoint substrings, each one keyed in its own exact-match table.
+    Two hashes within radius differ in at most radius substrings, so they share at least one of them :
+    a lookup only verifies the items sharing a substring with the query, and misses none.
+    """
+    def __init__(self, radius: int = DEFAULT_DIST) -> None:
+        self.__radius = radius
+        parts = min(radius + 1, HASH_SIZE * HASH_SIZE)
+        widths = [HASH_SIZE * HASH_SIZE // parts + (1 if k < HASH_SIZE * HASH_SIZE % parts else 0) for k in range(parts)]
+        # (shift, mask) of every substring
+        self.__parts = [(sum(widths[:k]), (1 << widths[k]) - 1) for k in range(parts)]
+        self.__tables: list[dict[int, list]] = [{} for _ in range(parts)]
+        self.__hashes = {}
+
+    def __len__(self):
+        return len(self.__hashes)
+
+    def ret_radius(self):
+        return self.__radius
+
+    def add(self, h: int, item) -> None:
+        self.__hashes[item] = h
+        for table, (shift, mask) in zip(self.__tables, self.__parts):
+            table.setdefault((h >> shift) & mask, []).append(item)
+
+    def remove(self, h: int, item) -> bool:
+        """
+        removes an item stored under hash h
+
+        :returns true if the item was found
+        """
+        if self.__hashes.get(item) != h:
+            return False
+        del self.__hashes[item]
+        for table, (shift, mask) in zip(self.__tables, self.__parts):
+            table[(h >> shift) & mask].remove(item)
+        return True
+
+    def query(self, h: int, radius: int) -> list:
+        """
+        :returns every item whose hash is within radius of h, radius being at most the one of the index
+        """
+        if radius > self.__radius:
+            raise ValueError(f"radius {radius} above the {self.__radius} bits the index was built for")
+        seen = set()
+        for table, (shift, mask) in zip(self.__tables, self.__parts):
+            seen.update(table.get((h >> shift) & mask, ()))
+        return [item for item in seen if hamming(self.__hashes[item], h) <= radius]
@@ -1,9 +1,25 @@
 import utils
+import batch
+import review
+import cache
+import hashindex
+import sys
+import time
+import cProfile
+import state
+import cascade
+from metrics import Metrics
 import argparse as ap
+from report import Reporter
 
 
 def parse_argument():
     pars = ap.ArgumentParser()
+    pars.add_argument(
+        "folder", nargs = "*",
+        help = "Folders to scan with their subfolders, asked in a window when omitted"
+    )
+
     pars.add_argument(
         "-F", action = "store_true",
         help = "Use fast search"
@@ -13,8 +29,161 @@ def parse_argument():
         "-A", action = "store_true",
         help = "Use accurate search"
     )
+
+    pars.add_argument(
+        "--cache", default = cache.DEFAULT_PATH,
+        help = "Signature cache file, reused between runs (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--cache-size", type = int, default = cache.DEFAULT_SIZE // (1024 * 1024),
+        help = "Maximum size of the signature cache in MB, least recently used entries are evicted"
+    )
+
+    pars.add_argument(
+        "--no-cache", action = "store_true",
+        help = "Always recompute signatures"
+    )
+
+    pars.add_argument(
+        "--hash-dist", type = int, default = hashindex.DEFAULT_DIST,
+        help = "Only compare images whose perceptual hashes differ by at most this many bits (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--exhaustive", action = "store_true",
+        help = "Compare every pair of images instead of looking up hash neighbours"
+    )
+
+    pars.add_argument(
+        "--jobs", type = int, default = 1,
+        help = "Number of processes used to extract signatures (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--memory", type = int, default = 1024,
+        help = "Memory budget of the signatures in MB, the next ones are memory-mapped on disk (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--spill-dir",
+        help = "Folder of the memory-mapped signatures past --memory (default: the system temporary folder)"
+    )
+
+    pars.add_argument(
+        "--reduced-decode", action = "store_true",
+        help = "Let the decoder scale JPEG images down to the signature size, faster but scores change and close pairs can be missed"
+    )
+
+    pars.add_argument(
+        "--max-diff", type = float, default = 5.0,
+        help = "Fast search : largest channel difference in percent for a match (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--min-score", type = float, default = -1.0,
+        help = "Accurate search : lowest score for a match (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--cascade", default = ",".join(cascade.DEFAULT),
+        help = "Accurate search : filters run before each comparison, among "
+               + ", ".join(cascade.STAGES) + " (default: %(default)s, the filters that never miss a match)"
+    )
+
+    pars.add_argument(
+        "--max-aspect", type = float, default = 0.1,
+        help = "Cascade aspect filter : largest relative difference of the aspect ratios (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--max-grid", type = float, default = 40.0,
+        help = "Cascade grid filter : largest mean difference of the 4x4 colour grids, out of 255 (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--headless", action = "store_true",
+        help = "Run without any window, every match is reported instead of reviewed"
+    )
+
+    pars.add_argument(
+        "--format", choices = ["json", "csv"], default = "json",
+        help = "Headless report format, one JSON object or CSV row per duplicate (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--groups", action = "store_true",
+        help = "Headless : report every group of duplicates once the search is over instead of every pair"
+    )
+
+    pars.add_argument(
+        "-o", "--output",
+        help = "Headless report file (default: stdout)"
+    )
+
+    pars.add_argument(
+        "--delete", action = "store_true",
+        help = "Headless : delete every duplicate found"
+    )
+
+    pars.add_argument(
+        "--move", metavar = "DIR",
+        help = "Headless : move every duplicate found into DIR"
+    )
+
+    pars.add_argument(
+        "--dry-run", action = "store_true",
+        help = "Headless : report what --delete or --move would do without touching any file"
+    )
+
+    pars.add_argument(
+        "--prefetch", type = int, default = review.PREFETCH,
+        help = "Number of upcoming pairs whose thumbnails are decoded ahead of the review (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--update", action = "store_true",
+        help = "Only check new or modified images against the result of the previous runs, kept in --state"
+    )
+
+    pars.add_argument(
+        "--watch", type = float, metavar = "SECONDS",
+        help = "Like --update, then look for changes again every SECONDS until interrupted"
+    )
+
+    pars.add_argument(
+        "--state", default = state.DEFAULT_PATH,
+        help = "Result of the previous runs used by --update and --watch (default: %(default)s)"
+    )
+
+    pars.add_argument(
+        "--progress", action = "store_true",
+        help = "Headless : print progress, throughput and ETA on stderr (always on with the window)"
+    )
+
+    pars.add_argument(
+        "--profile", metavar = "FILE",
+        help = "Write a JSON summary of the time spent in every stage and of the run counters to FILE"
+    )
+
+    pars.add_argument(
+        "--cprofile", metavar = "FILE",
+        help = "Run under cProfile and write its stats to FILE, to be read with pstats or snakeviz"
+    )
     return pars.parse_args()
 
+def launch(r: utils.RunApp, index: state.IndexState | None, watch: float | None) -> None:
+    """
+    full run without index, else an update against it, repeated every watch seconds if given
+    """
+    if index is None:
+        r.run()
+        return
+    r.update(index)
+    while watch is not None:
+        time.sleep(watch)
+        r.update(index)
+
 if __name__ == "__main__":
     args = parse_argument()
 
@@ -26,5 +195,49 @@ if __name__ == "__main__":
         #raise SystemExit("Please specify -A or -F for fast or accurate search")
         mode = "A"
 
-    r = utils.RunApp(mode)
-    r.run()
\ No newline at end of file
+    store = None if args.no_cache else cache.SignatureCache(args.cache, args.cache_size * 1024 * 1024)
+
+    try:
+        filters = cascade.Cascade([stage for stage in args.cascade.split(",") if stage != ""], args.min_score,
+                                  args.max_aspect, args.max_grid)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    metrics = Metrics(sys.stderr if args.progress or not args.headless else None)
+    opts = dict(cache = store, hash_dist = None if args.exhaustive else args.hash_dist, jobs = args.jobs,
+                max_diff = args.max_diff, min_score = args.min_score, reduced = args.reduced_decode, metrics = metrics,
+                memory = args.memory * 1024 * 1024, spill_dir = args.spill_dir, cascade = filters)
+
+    index = state.IndexState(args.state) if args.update or args.watch is not None else None
+
+    profiler = None
+    if args.cprofile is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if args.headless:
+        if args.folder == []:
+            raise SystemExit("A folder is required in headless mode")
+        if args.delete and args.move is not None:
+            raise SystemExit("--delete and --move can't be used together")
+        action = "delete" if args.delete else "move" if args.move is not None else None
+
+        out = sys.stdout if args.output is None else open(args.output, "w", newline = "")
+        r = batch.BatchApp(mode, Reporter(out, args.format), action, args.move, args.dry_run, args.groups, path = args.folder or None, **opts)
+        try:
+            launch(r, index, args.watch)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    else:
+        r = review.ReviewApp(mode, args.prefetch, path = args.folder or None, **opts)
+        launch(r, index, args.watch)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+    if args.profile is not None:
+        metrics.dump(args.profile)
+    if index is not None:
+        index.close()
+    if store is not None:
+        store.close()
\ No newline at end of file
@@ -0,0 +1,121 @@
+import json
+import time
+from contextlib import contextmanager
+
+STAGES = ["enumerate", "exact", "decode", "signature", "compare", "review"]
+
+
+class Metrics:
+    """
+    timers and counters of a run \n
+    stage times add up the time spent in each stage (summed over workers when extraction runs on a pool),
+    progress is printed to stream and sent to the hooks at most once every interval seconds
+    """
+    def __init__(self, stream = None, interval: float = 1.0) -> None:
+        self.__stream = stream
+        self.__interval = interval
+        self.__times: dict[str, float] = {}
+        self.__calls: dict[str, int] = {}
+        self.__counters: dict[str, int] = {}
+        self.__hooks = []
+        self.__start = time.perf_counter()
+        self.__last = self.__start
+        # number of images to process, None until known
+        self.total = None
+
+    def subscribe(self, hook) -> None:
+        """
+        registers hook(event, data), called with "progress" and a progress dict,
+        and with "done" and the summary once the run is over
+        """
+        self.__hooks.append(hook)
+
+    def emit(self, event: str, data: dict) -> None:
+        for hook in self.__hooks:
+            hook(event, data)
+
+    def add_time(self, stage: str, seconds: float, calls: int = 1) -> None:
+        self.__times[stage] = self.__times.get(stage, 0.0) + seconds
+        self.__calls[stage] = self.__calls.get(stage, 0) + calls
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def timed_iter(self, stage: str, it):
+        """
+        yields the items of it, the time spent producing them is added to stage
+        """
+        it = iter(it)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start, 0)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.__counters[name] = self.__counters.get(name, 0) + n
+
+    def ret_count(self, name: str) -> int:
+        return self.__counters.get(name, 0)
+
+    def state(self) -> dict:
+        """
+        :returns the current progress : images done, total, throughput in images/s and ETA in seconds
+        """
+        elapsed = time.perf_counter() - self.__start
+        done = self.ret_count("images")
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = max(self.total - done, 0) / rate
+        return {
+            "images": done, "total": self.total, "comparisons": self.ret_count("comparisons"),
+            "matches": self.ret_count("matches"), "elapsed": elapsed, "rate": rate, "eta": eta
+        }
+
+    def progress(self, force: bool = False) -> None:
+        """
+        reports progress unless the last report is less than interval seconds old
+        """
+        now = time.perf_counter()
+        if not force and now - self.__last < self.__interval:
+            return
+        self.__last = now
+        data = self.state()
+        if self.__stream is not None:
+            total = "?" if data["total"] is None else data["total"]
+            eta = "?" if data["eta"] is None else f"{data['eta']:.0f}s"
+            print(
+                f"{data['images']}/{total} images, {data['comparisons']} comparisons, {data['matches']} matches, "
+                f"{data['rate']:.1f} images/s, ETA {eta}", file = self.__stream, flush = True
+            )
+        self.emit("progress", data)
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self.__start
+        stages = {}
+        for stage in STAGES + sorted(set(self.__times) - set(STAGES)):
+            if stage in self.__times:
+                stages[stage] = {"seconds": round(self.__times[stage], 6), "calls": self.__calls[stage]}
+        return {
+            "elapsed": round(elapsed, 6), "stages": stages, "counters": dict(self.__counters),
+            "images_per_second": round(self.ret_count("images") / elapsed, 3) if elapsed > 0 else 0.0
+        }
+
+    def finish(self) -> None:
+        self.progress(force = True)
+        self.emit("done", self.summary())
+
+    def dump(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent = 2)
+            f.write("\n")
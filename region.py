@@ -1,24 +1,139 @@
+import numpy as np
+
+CHUNK = 1024
+
+
 class Region:
-    def __init__(self, dims):
+    __slots__ = ("dims", "group", "avg", "centroid", "bbox")
+
+    def __init__(self, dims, group = None):
         self.dims = dims
-        self.group = []
+        # (n, 2) array of the (i, j) cells of the region, in row-major order
+        self.group = np.empty((0, 2), dtype = np.int32) if group is None else group
         self.avg = ()
-    
-    def avg_det(self, convu):
-        avg_r, avg_g, avg_b = 0, 0, 0
-        for pos in self.group:
-            avg_r += int(convu[pos[0]][pos[1]][0])
-            avg_g += int(convu[pos[0]][pos[1]][1])
-            avg_b += int(convu[pos[0]][pos[1]][2])
-        avg_r /= len(self.group)
-        avg_g /= len(self.group)
-        avg_b /= len(self.group)
-        self.avg = (avg_r, avg_g, avg_b)
-
-
-    def avg_clrs(groups: list["Region"], convu) -> list[tuple]:
-        if groups == []:
-            return []
-        for rg in groups:
-            rg.avg_det(convu)
-        return groups
\ No newline at end of file
+        # filled by shape_det : mean (i, j) cell, and (i min, j min, i max, j max) normalized by dims
+        self.centroid = None
+        self.bbox = None
+
+    def shape_det(self):
+        cells = self.group.astype(np.float64)
+        self.centroid = cells.mean(axis = 0)
+        norm = cells / np.array([self.dims[0], self.dims[1]], dtype = np.float64)
+        self.bbox = np.concatenate([norm.min(axis = 0), norm.max(axis = 0)])
+
+    def cluster(arr, radius: float = 50) -> list["Region"]:
+        """
+        groups the cells of an (h, w, 3) grid into regions of close colour \n
+        cells are visited in row-major order and join the first region whose average is within radius,
+        or start a new one. Averages are only refreshed when a region is created. \n
+        Running sums keep that refresh O(regions), and every cell between two creations is matched
+        at once against the array of averages.
+
+        :returns the regions in creation order
+        """
+        h, w = arr.shape[:2]
+        cells = np.asarray(arr, dtype = np.float64).reshape(-1, 3)
+        labels = np.empty(len(cells), dtype = np.int64)
+        sums = np.zeros((16, 3))
+        counts = np.zeros(16, dtype = np.int64)
+        avgs = np.zeros((0, 3))
+        lim = radius * radius
+
+        pos = 0
+        while pos < len(cells):
+            block = cells[pos:pos + CHUNK]
+            if len(avgs) > 0:
+                hit = ((block[:, None, :] - avgs[None, :, :]) ** 2).sum(axis = 2) <= lim
+                found = hit.any(axis = 1)
+                first = hit.argmax(axis = 1)
+            else:
+                found = np.zeros(len(block), dtype = bool)
+                first = np.zeros(len(block), dtype = np.int64)
+
+            # every cell before the first unmatched one keeps the current averages
+            miss = np.flatnonzero(~found)
+            stop = miss[0] if len(miss) > 0 else len(block)
+            labels[pos:pos + stop] = first[:stop]
+            np.add.at(sums, first[:stop], block[:stop])
+            counts += np.bincount(first[:stop], minlength = len(counts))
+            pos += stop
+            if stop == len(block):
+                continue
+
+            k = len(avgs)
+            if k == len(counts):
+                sums = np.concatenate([sums, np.zeros_like(sums)])
+                counts = np.concatenate([counts, np.zeros_like(counts)])
+            sums[k] = cells[pos]
+            counts[k] = 1
+            labels[pos] = k
+            avgs = sums[:k + 1] / counts[:k + 1, None]
+            pos += 1
+
+        return Region.from_labels(labels.reshape(h, w), avgs)
+
+    def to_labels(groups: list["Region"], shape) -> tuple:
+        """
+        packs regions into a compact (labels, avgs) pair \n
+        labels[i][j] is the index of the region holding cell (i, j), avgs[k] is the average of region k
+        """
+        labels = np.full(shape, -1, dtype = np.int32)
+        for k, rg in enumerate(groups):
+            labels[rg.group[:, 0], rg.group[:, 1]] = k
+        avgs = np.array([rg.avg for rg in groups], dtype = np.float64).reshape(-1, 3)
+        return labels, avgs
+
+    def from_labels(labels, avgs) -> list["Region"]:
+        """
+        rebuilds the regions packed by to_labels, cells are listed in row-major order like region_det does
+        """
+        dims = (labels.shape[1], labels.shape[0])
+        flat = labels.ravel()
+        order = np.argsort(flat, kind = "stable")
+        cells = np.stack(np.divmod(order, labels.shape[1]), axis = 1).astype(np.int32)
+        bounds = np.cumsum(np.bincount(flat, minlength = len(avgs)))[:-1]
+        groups = []
+        for k, group in enumerate(np.split(cells, bounds)):
+            rg = Region(dims, group)
+            rg.avg = tuple(float(c) for c in avgs[k])
+            rg.shape_det()
+            groups.append(rg)
+        return groups
+
+
+class RegionSet:
+    """
+    compact regions of one image, all accurate_find needs once the cells are no longer required \n
+    rows[k] holds the average colour (3), normalized bounding box (4) and centroid (2) of region k, in float32
+    """
+    __slots__ = ("dims", "rows")
+    WIDTH = 9
+
+    def __init__(self, dims, rows):
+        self.dims = dims
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def ret_avgs(self):
+        return self.rows[:, 0:3].astype(np.float64)
+
+    def ret_bboxes(self):
+        return self.rows[:, 3:7].astype(np.float64)
+
+    def ret_centroids(self):
+        return self.rows[:, 7:9].astype(np.float64)
+
+    def of(rgs) -> "RegionSet":
+        """
+        packs a list of regions, a RegionSet is returned as is
+        """
+        if isinstance(rgs, RegionSet):
+            return rgs
+        rows = np.empty((len(rgs), RegionSet.WIDTH), dtype = np.float32)
+        for k, rg in enumerate(rgs):
+            rows[k, 0:3] = rg.avg
+            rows[k, 3:7] = rg.bbox
+            rows[k, 7:9] = rg.centroid
+        return RegionSet(rgs[0].dims, rows)
@@ -0,0 +1,45 @@
+import csv
+import json
+
+
+class Reporter:
+    """
+    streams duplicate pairs as JSON lines or CSV rows \n
+    every pair is flushed as soon as it is written so that a pipeline can consume it right away,
+    groups are written as {"keep": ..., "duplicates": [...]} lines, or as one "group" row per duplicate in CSV
+    """
+    FIELDS = ["keep", "duplicate", "mode", "score", "action"]
+
+    def __init__(self, stream, fmt: str = "json") -> None:
+        self.__stream = stream
+        self.__fmt = fmt
+        self.__count = 0
+        self.__writer = None
+        if fmt == "csv":
+            self.__writer = csv.writer(stream)
+            self.__writer.writerow(self.FIELDS)
+            stream.flush()
+
+    def ret_count(self):
+        return self.__count
+
+    def pair(self, keep: str, dup: str, mode: str, score: float, action: str) -> None:
+        row = [keep, dup, mode, round(float(score), 4), action]
+        if self.__writer is not None:
+            self.__writer.writerow(row)
+        else:
+            self.__stream.write(json.dumps(dict(zip(self.FIELDS, row))) + "\n")
+        self.__stream.flush()
+        self.__count += 1
+
+    def group(self, names: list[str]) -> None:
+        """
+        writes a group of duplicates, names[0] being the file kept
+        """
+        if self.__writer is not None:
+            for dup in names[1:]:
+                self.__writer.writerow([names[0], dup, "group", "", ""])
+        else:
+            self.__stream.write(json.dumps({"keep": names[0], "duplicates": names[1:]}) + "\n")
+        self.__stream.flush()
+        self.__count += 1
@@ -0,0 +1,348 @@
+import os
+import queue
+import sys
+import threading
+import time
+import tkinter as tk
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import takewhile
+from PIL import Image, ImageTk
+import hashindex
+import utils
+
+PREFETCH = 8
+THUMBS = 64
+HEIGHT = 250
+
+
+def thumbnail(name: str) -> Image.Image:
+    """
+    loads an image scaled to HEIGHT pixels high, JPEG files are scaled down by the decoder on the way
+    """
+    return utils.File(name).thumbnail(HEIGHT)
+
+
+class Thumbs:
+    """
+    bounded LRU of review thumbnails, decoded ahead of time by a few threads \n
+    PIL images are kept, Tk photo images can only be made on the Tk thread when shown
+    """
+    def __init__(self, capacity: int = THUMBS, workers: int = 2) -> None:
+        self.__capacity = capacity
+        # name -> Future while decoding, then the thumbnail
+        self.__items: OrderedDict[str, Future | Image.Image] = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__pool = ThreadPoolExecutor(max_workers = workers)
+
+    def __len__(self):
+        return len(self.__items)
+
+    def prefetch(self, name: str) -> None:
+        with self.__lock:
+            self.__entry(name)
+
+    def get(self, name: str) -> Image.Image:
+        """
+        :returns the thumbnail of name, waiting for it when it is not decoded yet
+        """
+        with self.__lock:
+            item = self.__entry(name)
+        if isinstance(item, Future):
+            img = item.result()
+            with self.__lock:
+                if self.__items.get(name) is item:
+                    self.__items[name] = img
+            return img
+        return item
+
+    def __entry(self, name: str):
+        if name in self.__items:
+            self.__items.move_to_end(name)
+            return self.__items[name]
+        item = self.__pool.submit(thumbnail, name)
+        self.__items[name] = item
+        while len(self.__items) > self.__capacity:
+            _, old = self.__items.popitem(last = False)
+            if isinstance(old, Future):
+                old.cancel()
+        return item
+
+    def close(self) -> None:
+        self.__pool.shutdown(cancel_futures = True)
+
+
+class ReviewApp(utils.RunApp):
+    """
+    RunApp reviewed in one persistent window \n
+    the search runs on a background thread and queues the pairs it finds, each one counting as a duplicate
+    until the reviewer rejects it. The other matches of the image are shown next, and once all of them
+    are rejected the image goes back into the index. Thumbnails of the next prefetch pairs are decoded
+    ahead of time, so neither the reviewer nor the search waits for the other.
+    """
+    def __init__(self, mode, prefetch: int = PREFETCH, thumbs: int = THUMBS, **kwargs):
+        super().__init__(mode, **kwargs)
+        self.prefetch = prefetch
+        self.thumbs = Thumbs(max(thumbs, 2 * prefetch + 2))
+        # (keep, dup, score, exact, index of dup, [(keep, score)] of the other matches, whether keep is the first match)
+        # found by the search, None once it is over
+        self.pairs = queue.Queue()
+        # (dup, index of dup, keep, score) answered by the reviewer, read back by the search :
+        # keep is None when every match of dup was rejected, else the match confirmed instead of the first one
+        self.rejected = queue.Queue()
+        # pairs queued by the search and pairs answered for good by the reviewer, each one written by one thread
+        self.queued = 0
+        self.answered = 0
+        self.closed = False
+        self.wind = None
+
+    def review(self, keep: utils.File, dup: utils.File, score: float, exact: bool = False) -> bool:
+        # dup is the image being processed, the last one added unless it is an exact copy
+        self.queue((keep, dup, score, exact, None if exact else len(self.images) - 1, [], True))
+        return True
+
+    def confirm(self, i: int, matches: list[tuple]) -> tuple | None:
+        # the first match counts until the reviewer answers, the others go along to be shown if it is rejected
+        if not matches:
+            return None
+        self.metrics.count("matches")
+        (k, score), rest = matches[0], matches[1:]
+        self.queue((self.images[k], self.images[i], score, False, i, [(self.images[m], s) for m, s in rest], True))
+        return k, score
+
+    def queue(self, pair: tuple) -> None:
+        self.queued += 1
+        self.pairs.put(pair)
+
+    def drive(self, job) -> None:
+        self.closed = False
+        worker = threading.Thread(target = self.work, args = (job,), daemon = True)
+        worker.start()
+        unreviewed = self.window()
+        worker.join()
+        # pairs left when the window is closed early stay undecided, like in a run that never found them
+        while True:
+            try:
+                pair = self.pairs.get_nowait()
+            except queue.Empty:
+                break
+            if pair is not None:
+                unreviewed.append(pair)
+        for _, dup, _, _, i, _, _ in unreviewed:
+            self.rejected.put((dup, i, None, None))
+        self.readmit(recompare = False)
+
+    def work(self, job) -> None:
+        try:
+            job()
+            # answers given once the search is over may still bring new pairs, see recompare
+            while not self.closed and (self.answered < self.queued or not self.rejected.empty()):
+                self.readmit()
+                time.sleep(0.05)
+        finally:
+            self.pairs.put(None)
+
+    def search(self, files) -> None:
+        super().search(takewhile(lambda _: not self.closed, files))
+
+    def process(self, im: utils.File, sig) -> None:
+        self.readmit()
+        super().process(im, sig)
+
+    def readmit(self, recompare: bool = True) -> None:
+        """
+        puts the images rejected by the reviewer back into the index and the record of the run,
+        and moves the ones confirmed as the duplicate of another match than the first. With recompare,
+        a rejected image is then compared with the images kept while it waited
+        """
+        while True:
+            try:
+                dup, i, keep, score = self.rejected.get_nowait()
+            except queue.Empty:
+                return
+            if keep is not None:
+                self.clusters.split(dup.ret_name())
+                self.clusters.union(keep.ret_name(), dup.ret_name())
+                self.record_pair(keep.ret_name(), dup.ret_name(), score)
+                continue
+            h = None
+            if i is not None:
+                h = self.hashes[i]
+                self.index.add(h, i)
+                self.kept.append(i)
+                self.metrics.count("removed", -1)
+            self.clusters.split(dup.ret_name())
+            if self.state is not None:
+                self.state.unpair(self.signature_kind()[0], dup.ret_name())
+            self.record(dup, h, True)
+            if recompare and i is not None:
+                self.recompare(i)
+
+    def recompare(self, i: int) -> None:
+        """
+        compares a readmitted image with the images kept after it, which never had it as a candidate,
+        as the search would have if it had been kept at once : a later image matching it is queued as its duplicate
+        """
+        h = self.hashes[i]
+        for k in [k for k in self.kept if k > i]:
+            if self.hash_dist is not None and hashindex.hamming(self.hashes[k], h) > self.hash_dist:
+                continue
+            with self.metrics.timer("compare"):
+                _, is_dup, score = self.compare_all(k, [i], self.images, self.sigs)[0]
+            self.metrics.count("comparisons")
+            if not is_dup:
+                continue
+            self.metrics.count("matches")
+            self.metrics.count("removed")
+            self.index.remove(self.hashes[k], k)
+            self.kept.remove(k)
+            self.clusters.union(self.images[i].ret_name(), self.images[k].ret_name())
+            self.record_pair(self.images[i].ret_name(), self.images[k].ret_name(), score)
+            self.record(self.images[k], self.hashes[k], False)
+            self.queue((self.images[i], self.images[k], score, False, k, [], True))
+
+    def window(self) -> list[tuple]:
+        """
+        shows the queued pairs one after the other until the search is over and every pair is answered,
+        or until the window is closed
+
+        :returns the pairs left unanswered
+        """
+        self.wind = tk.Tk()
+        self.wind.title("Comparison Window")
+        self.wind.iconbitmap(self.ui.find_logo())
+        self.wind.update_idletasks()
+        x = (self.wind.winfo_screenwidth() // 2) - 500
+        y = (self.wind.winfo_screenheight() // 2) - 300
+        self.wind.geometry(f'{1000}x{600}+{x}+{y}')
+
+        self.upcoming = deque()
+        self.current = None
+        self.finished = False
+        self.photos = []
+
+        self.ImLabel1 = tk.Label(self.wind)
+        self.ImLabel2 = tk.Label(self.wind)
+        self.ImLabel1.place_configure(relx = 0.25, rely = 0.15, anchor = "n")
+        self.ImLabel2.place_configure(relx = 0.75, rely = 0.15, anchor = "n")
+
+        self.heading = tk.Label(self.wind, text = "Searching for duplicates...", font = ("Times New Roman", 20))
+        self.heading.pack(pady = 20)
+        self.names = tk.Label(self.wind, font = ("Times New Roman", 12))
+        self.names.place_configure(relx = 0.5, rely = 0.62, anchor = "center")
+        self.status = tk.Label(self.wind, font = ("Times New Roman", 12))
+        self.status.place_configure(relx = 0.5, rely = 0.95, anchor = "center")
+
+        buttonText = tk.Label(self.wind, text = "Do you confirm this statement ? (Answer with either yes or no) ", font = ("Times New Roman", 20))
+        buttonText.place_configure(relx = 0.5, rely = 0.7, anchor = "center")
+
+        button_conf = tk.Button(self.wind, text = "Yes", font = ("Times New Roman", 20), command = lambda: self.answer(True))
+        button_conf.place_configure(relx = 0.45, rely = 0.8, anchor = "center")
+
+        button_deny = tk.Button(self.wind, text = "No", font = ("Times New Roman", 20), command = lambda: self.answer(False))
+        button_deny.place_configure(relx = 0.55, rely = 0.8, anchor = "center")
+
+        self.wind.bind("y", lambda event: self.answer(True))
+        self.wind.bind("n", lambda event: self.answer(False))
+        self.wind.protocol("WM_DELETE_WINDOW", self.close)
+        self.wind.after(0, self.poll)
+        self.wind.mainloop()
+
+        left = list(self.upcoming)
+        if self.current is not None:
+            left.insert(0, self.current)
+        return left
+
+    def poll(self) -> None:
+        """
+        moves the pairs found since the last call into the upcoming ones, prefetches the first of them
+        and shows the next pair once the current one is answered
+        """
+        if self.closed:
+            return
+        while True:
+            try:
+                pair = self.pairs.get_nowait()
+            except queue.Empty:
+                break
+            if pair is None:
+                self.finished = True
+            else:
+                self.upcoming.append(pair)
+
+        for keep, dup, _, _, _, _, _ in list(self.upcoming)[:self.prefetch]:
+            self.thumbs.prefetch(keep.ret_name())
+            self.thumbs.prefetch(dup.ret_name())
+
+        while self.current is None and self.upcoming:
+            self.show(self.upcoming.popleft())
+        if self.current is None and self.finished:
+            self.wind.destroy()
+            return
+
+        data = self.metrics.state()
+        self.status.config(text = f"{data['images']} images checked, {data['comparisons']} comparisons, "
+                                  f"{len(self.upcoming)} pairs waiting" + ("" if self.finished else ", searching..."))
+        self.wind.after(50, self.poll)
+
+    def show(self, pair: tuple) -> None:
+        keep, dup, score, exact, _, _, _ = pair
+        try:
+            photos = [ImageTk.PhotoImage(self.thumbs.get(keep.ret_name())),
+                      ImageTk.PhotoImage(self.thumbs.get(dup.ret_name()))]
+        except OSError:
+            # one of the files can't be shown, the pair counts as rejected
+            self.reject(pair)
+            return
+        self.photos = photos
+        self.ImLabel1.config(image = photos[0])
+        self.ImLabel2.config(image = photos[1])
+        self.heading.config(text = "These two images are byte-identical." if exact else "These two images seem to be identical.")
+        self.names.config(text = f"{keep.ret_name()}   /   {dup.ret_name()}" + ("" if exact else f"   (score {score:.3f})"))
+        self.current = pair
+        self.shown = time.perf_counter()
+
+    def answer(self, confirmed: bool) -> None:
+        """
+        deletes the duplicate of the current pair when confirmed, else hands it back to the search
+        """
+        if self.current is None:
+            return
+        keep, dup, score, exact, i, _, first = self.current
+        self.metrics.add_time("review", time.perf_counter() - self.shown)
+        if confirmed:
+            try:
+                os.remove(dup.ret_name())
+            except OSError as e:
+                print(f"could not delete {dup.ret_name()} : {e}", file = sys.stderr)
+            if not first:
+                # the search recorded dup as a duplicate of its first match
+                self.rejected.put((dup, i, keep, score))
+            self.answered += 1
+        else:
+            self.reject(self.current)
+        self.current = None
+        self.ImLabel1.config(image = "")
+        self.ImLabel2.config(image = "")
+        self.names.config(text = "")
+        self.heading.config(text = "Searching for duplicates...")
+        while self.current is None and self.upcoming:
+            self.show(self.upcoming.popleft())
+
+    def reject(self, pair: tuple) -> None:
+        """
+        puts the next match of the duplicate of pair in front of the upcoming pairs, hands the duplicate back
+        to the search when there is none left
+        """
+        _, dup, _, exact, i, rest, _ = pair
+        if rest:
+            (keep, score), rest = rest[0], rest[1:]
+            self.upcoming.appendleft((keep, dup, score, exact, i, rest, False))
+        else:
+            # counted once handed over, so that the search sees the rejection before the count
+            self.rejected.put((dup, i, None, None))
+            self.answered += 1
+
+    def close(self) -> None:
+        self.closed = True
+        self.wind.destroy()
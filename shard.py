@@ -0,0 +1,250 @@
+import argparse as ap
+import os
+import sqlite3
+import sys
+import time
+from types import SimpleNamespace
+import cache
+import exact
+import hashindex
+import utils
+import batch
+from report import Reporter
+
+FORMAT = "duplikate-shard"
+VERSION = 1
+
+
+class Shard:
+    """
+    portable signature shard : one SQLite file holding the signatures of every image of a subtree \n
+    table meta holds the format, version, signature kind and buffer (see RunApp.signature_kind) and the root
+    the paths are relative to. Table images holds, in scan order, the path, byte size, mtime in ns, image width
+    and height, a blake2b digest of the whole file and the signature serialized as in the cache
+    (.npy conv grid, or .npz labels and averages of the regions).
+    """
+    def __init__(self, path: str, create: bool = False) -> None:
+        if not create and not os.path.isfile(path):
+            raise FileNotFoundError(f"{path} : no such shard")
+        self.__path = path
+        self.__db = sqlite3.connect(path)
+        if create:
+            self.__db.execute("DROP TABLE IF EXISTS meta")
+            self.__db.execute("DROP TABLE IF EXISTS images")
+            self.__db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.__db.execute(
+                "CREATE TABLE images (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+                "width INTEGER, height INTEGER, digest BLOB, data BLOB)"
+            )
+        elif self.meta().get("format") != FORMAT:
+            raise ValueError(f"{path} is not a signature shard")
+        elif int(self.meta()["version"]) > VERSION:
+            raise ValueError(f"{path} : shard version {self.meta()['version']} is not supported")
+
+    def ret_path(self):
+        return self.__path
+
+    def meta(self) -> dict[str, str]:
+        return dict(self.__db.execute("SELECT key, value FROM meta"))
+
+    def set_meta(self, kind: str, buffer: int, root: str) -> None:
+        rows = {"format": FORMAT, "version": VERSION, "kind": kind, "buffer": buffer, "root": root,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        self.__db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [(k, str(v)) for k, v in rows.items()])
+
+    def add(self, path: str, size: int, mtime: int, dims: tuple, digest: bytes, data: bytes) -> None:
+        self.__db.execute(
+            "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path, size, mtime, dims[0], dims[1], digest, data)
+        )
+
+    def rows(self):
+        """
+        yields (name, size, mtime, (width, height), digest, data) in scan order, names joined with the root
+        """
+        root = self.meta()["root"]
+        for path, size, mtime, width, height, digest, data in self.__db.execute(
+            "SELECT path, size, mtime, width, height, digest, data FROM images ORDER BY rowid"
+        ):
+            yield os.path.join(root, path), size, mtime, (width, height), digest, data
+
+    def __len__(self):
+        return self.__db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def close(self) -> None:
+        self.__db.commit()
+        self.__db.close()
+
+
+class ShardFile(utils.File):
+    """
+    image known from a shard only, it may live on another machine : its header comes from the shard
+    and it is never opened
+    """
+    __slots__ = ()
+
+    def __init__(self, name: str, size: int, mtime: int, dims: tuple) -> None:
+        super().__init__(name, SimpleNamespace(st_size = size, st_mtime_ns = mtime))
+        self.set_header((dims, None, None))
+
+
+def build(app: utils.RunApp, out: str) -> int:
+    """
+    extracts the signatures of every image under app.path into the shard out, through the cache and
+    process pool of app
+
+    :returns the number of images written
+    """
+    app.get_path()
+    app.check_roots()
+    if len(app.folder.ret_roots()) != 1:
+        app.fail("A shard is built from a single folder")
+    root = os.path.abspath(app.folder.ret_roots()[0])
+    kind, buffer = app.signature_kind()
+    shard = Shard(out, create = True)
+    shard.set_meta(kind, buffer, root)
+    count = 0
+    try:
+        for im, sig in app.signed(app.metrics.timed_iter("enumerate", app.folder.scan())):
+            im.size_get()
+            with app.metrics.timer("exact"):
+                digest = exact.file_hash(im.ret_name())
+            st = im.ret_stat()
+            rel = os.path.relpath(os.path.abspath(im.ret_name()), root)
+            shard.add(rel, st.st_size, st.st_mtime_ns, im.ret_size(), digest, cache.encode(kind, sig))
+            count += 1
+            app.metrics.count("images")
+            app.metrics.progress()
+    finally:
+        shard.close()
+    app.metrics.finish()
+    return count
+
+
+class ShardApp(batch.BatchApp):
+    """
+    headless search across shards, the images are never read : exact copies are found on the shard digests
+    and every other image is compared on its stored signature
+    """
+    def __init__(self, mode, reporter: Reporter, shards: list[str], **kwargs):
+        super().__init__(mode, reporter, **kwargs)
+        self.shards = shards
+
+    def get_path(self):
+        self.folder = utils.Folder()
+
+    def run(self):
+        self.get_path()
+        self.reset()
+        shards = [Shard(path) for path in self.shards]
+        try:
+            kind, buffer = self.signature_kind()
+            for shard in shards:
+                meta = shard.meta()
+                if meta["kind"] != kind or int(meta["buffer"]) != buffer:
+                    self.fail(f"{shard.ret_path()} holds {meta['kind']} signatures, {kind} expected")
+            self.metrics.total = sum(len(shard) for shard in shards)
+            self.drive(lambda: self.search_shards(shards, kind))
+        finally:
+            for shard in shards:
+                shard.close()
+        self.metrics.finish()
+        if self.scanned == 0:
+            self.fail("No images found in the given shards !")
+
+    def search_shards(self, shards: list[Shard], kind: str) -> None:
+        digests = {}
+        for shard in shards:
+            for name, size, mtime, dims, digest, data in shard.rows():
+                im = ShardFile(name, size, mtime, dims)
+                self.scanned += 1
+                self.metrics.count("scanned")
+                first = digests.setdefault(digest, name)
+                # a copy of a file removed as a duplicate goes through the comparison, see RunApp.unique
+                if first != name and self.clusters.find(first) == first:
+                    self.metrics.count("exact")
+                    if self.review(ShardFile(first, size, 0, dims), im, 0.0, exact = True):
+                        self.clusters.union(first, name)
+                    self.metrics.count("images")
+                    continue
+                with self.metrics.timer("decode"):
+                    sig = cache.decode(kind, data)
+                self.process(im, sig)
+
+
+def merge(paths: list[str], out: str) -> int:
+    """
+    writes the images of every shard into one shard with absolute paths, later shards win on duplicate paths
+
+    :returns the number of images written
+    """
+    shards = [Shard(path) for path in paths]
+    metas = [shard.meta() for shard in shards]
+    for path, meta in zip(paths, metas):
+        if (meta["kind"], meta["buffer"]) != (metas[0]["kind"], metas[0]["buffer"]):
+            raise SystemExit(f"{path} holds {meta['kind']} signatures, {metas[0]['kind']} expected")
+    merged = Shard(out, create = True)
+    merged.set_meta(metas[0]["kind"], int(metas[0]["buffer"]), "")
+    for shard in shards:
+        for name, size, mtime, dims, digest, data in shard.rows():
+            merged.add(name, size, mtime, dims, digest, data)
+        shard.close()
+    count = len(merged)
+    merged.close()
+    return count
+
+def parse_argument():
+    pars = ap.ArgumentParser(description = "Builds signature shards of subtrees and finds duplicates across them")
+    sub = pars.add_subparsers(dest = "command", required = True)
+
+    b = sub.add_parser("build", help = "Extract the signatures of a folder and its subfolders into a shard")
+    b.add_argument("folder", help = "Folder to scan")
+    b.add_argument("-o", "--output", required = True, help = "Shard file to write")
+    b.add_argument("-F", action = "store_true", help = "Fast search signatures (default: accurate)")
+    b.add_argument("--jobs", type = int, default = 1, help = "Number of processes used to extract signatures (default: %(default)s)")
+    b.add_argument("--reduced-decode", action = "store_true", help = "Let the decoder scale JPEG images down to the signature size, "
+                                                                      "faster but scores change and close pairs can be missed")
+    b.add_argument("--cache", default = cache.DEFAULT_PATH, help = "Signature cache file (default: %(default)s)")
+    b.add_argument("--no-cache", action = "store_true", help = "Always recompute signatures")
+
+    m = sub.add_parser("merge", help = "Merge shards and report the duplicates found across them")
+    m.add_argument("shards", nargs = "+", help = "Shard files, built with the same mode")
+    m.add_argument("--index", help = "Also write the merged shard to this file")
+    m.add_argument("--hash-dist", type = int, default = hashindex.DEFAULT_DIST,
+                   help = "Only compare images whose perceptual hashes differ by at most this many bits (default: %(default)s)")
+    m.add_argument("--exhaustive", action = "store_true", help = "Compare every pair of images")
+    m.add_argument("--max-diff", type = float, default = 5.0, help = "Fast search : largest channel difference in percent for a match (default: %(default)s)")
+    m.add_argument("--min-score", type = float, default = -1.0, help = "Accurate search : lowest score for a match (default: %(default)s)")
+    m.add_argument("--format", choices = ["json", "csv"], default = "json", help = "Report format (default: %(default)s)")
+    m.add_argument("--groups", action = "store_true", help = "Report groups of duplicates instead of pairs")
+    m.add_argument("-o", "--output", help = "Report file (default: stdout)")
+    return pars.parse_args()
+
+if __name__ == "__main__":
+    args = parse_argument()
+
+    if args.command == "build":
+        store = None if args.no_cache else cache.SignatureCache(args.cache)
+        app = batch.BatchApp("F" if args.F else "A", Reporter(sys.stderr), path = [args.folder], cache = store,
+                             jobs = args.jobs, reduced = args.reduced_decode)
+        try:
+            n = build(app, args.output)
+        finally:
+            if store is not None:
+                store.close()
+        print(f"{n} images written to {args.output}", file = sys.stderr)
+    else:
+        if args.index is not None:
+            print(f"{merge(args.shards, args.index)} images written to {args.index}", file = sys.stderr)
+        first = Shard(args.shards[0])
+        meta = first.meta()
+        first.close()
+        mode = "F" if meta["kind"].startswith("conv") else "A"
+        out = sys.stdout if args.output is None else open(args.output, "w", newline = "")
+        try:
+            ShardApp(mode, Reporter(out, args.format), args.shards, groups = args.groups,
+                     hash_dist = None if args.exhaustive else args.hash_dist, max_diff = args.max_diff,
+                     min_score = args.min_score, reduced = meta["kind"].endswith("-reduced")).run()
+        finally:
+            if out is not sys.stdout:
+                out.close()
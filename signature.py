@@ -0,0 +1,203 @@
+from PIL import Image
+from math import ceil, prod
+import tempfile
+import numpy as np
+
+# descriptor : DESC_GRID x DESC_GRID cells of (r, g, b) averages followed by a HIST_BINS³ colour histogram
+DESC_GRID = 8
+HIST_BINS = 4
+DESC_SIZE = DESC_GRID * DESC_GRID * 3 + HIST_BINS ** 3
+# pyramid : levels of size x size cells above the full grid, coarsest first
+PYRAMID = (1, 4, 16)
+
+
+def decode_image(img: Image.Image) -> np.ndarray:
+    """
+    decodes an open image straight into a NumPy array, the caller closes it \n
+    alpha is dropped and palette / grayscale images are expanded to RGB
+
+    :returns an (height, width, 3) uint8 array
+    """
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return np.asarray(img, dtype = np.uint8)
+
+def decode_reduced_image(img: Image.Image, buffer: int) -> tuple:
+    """
+    decodes an open image at a scale matched to the buffer, the caller closes it \n
+    JPEG images are scaled down by the decoder itself (DCT scaling through draft) by a power of two
+    dividing buffer, so that the block grid keeps the shape it has at full size,
+    other formats are decoded at full size
+
+    :returns (pixels, factor, full size), blocks are then buffer // factor pixels wide
+    """
+    size = img.size
+    factor = 1
+    if img.format == "JPEG":
+        most = min(buffer & -buffer, 8)
+        img.draft("RGB", (ceil(size[0] / most), ceil(size[1] / most)))
+        factor = min(f for f in (1, 2, 4, 8) if (ceil(size[0] / f), ceil(size[1] / f)) == img.size)
+    return decode_image(img), factor, size
+
+def block_means(pixels: np.ndarray, buffer: int) -> np.ndarray:
+    """
+    averages every BufferxBuffer block of an (height, width, 3) pixel array \n
+    blocks on the right and bottom edges may be smaller than BufferxBuffer,
+    they are averaged over the pixels they actually contain
+
+    :returns an (ceil(height / buffer), ceil(width / buffer), 3) float64 array
+    """
+    h, w = pixels.shape[:2]
+    rows = np.arange(0, h, buffer)
+    cols = np.arange(0, w, buffer)
+
+    # sums over ragged blocks, int64 keeps them exact before the division
+    sums = np.add.reduceat(pixels[:, :, :3], rows, axis = 0, dtype = np.int64)
+    sums = np.add.reduceat(sums, cols, axis = 1)
+
+    counts = np.outer(np.minimum(h - rows, buffer), np.minimum(w - cols, buffer))
+    return sums / counts[:, :, None]
+
+def resample(grid: np.ndarray, size: int) -> np.ndarray:
+    """
+    area-averages a (h, w, ...) grid down (or up) to (size, size, ...) \n
+    every output cell averages at least one input cell, so small grids are stretched
+
+    :returns a (size, size, ...) float64 array
+    """
+    h, w = grid.shape[:2]
+    steps = np.arange(size + 1)
+    r0, r1 = (steps[:-1] * h) // size, (steps[1:] * h) // size
+    c0, c1 = (steps[:-1] * w) // size, (steps[1:] * w) // size
+    r1, c1 = np.maximum(r1, r0 + 1), np.maximum(c1, c0 + 1)
+
+    # integral image, any rectangle sum is then four lookups
+    integral = np.zeros((h + 1, w + 1) + grid.shape[2:], dtype = np.float64)
+    integral[1:, 1:] = grid.cumsum(axis = 0).cumsum(axis = 1)
+    sums = integral[r1][:, c1] - integral[r0][:, c1] - integral[r1][:, c0] + integral[r0][:, c0]
+    counts = np.outer(r1 - r0, c1 - c0).reshape((size, size) + (1,) * (grid.ndim - 2))
+    return sums / counts
+
+def descriptor(grid: np.ndarray) -> np.ndarray:
+    """
+    fixed-length, resolution-independent summary of a (h, w, 3) grid of block averages :
+    the grid area-averaged down to DESC_GRID x DESC_GRID cells, then the share of blocks falling in each cell
+    of a HIST_BINS per channel colour histogram
+
+    :returns a (DESC_SIZE,) float32 array
+    """
+    cells = resample(grid, DESC_GRID).reshape(-1)
+    colours = np.asarray(grid, dtype = np.float64).reshape(-1, 3)
+    bins = np.minimum((colours * HIST_BINS / 256).astype(np.int64), HIST_BINS - 1)
+    codes = (bins[:, 0] * HIST_BINS + bins[:, 1]) * HIST_BINS + bins[:, 2]
+    hist = np.bincount(codes, minlength = HIST_BINS ** 3) / len(codes)
+    return np.concatenate([cells, hist]).astype(np.float32)
+
+def levels(shape: tuple) -> list[int]:
+    """
+    :returns the sizes of PYRAMID used for a grid of that shape, the ones not larger than the grid
+    """
+    return [size for size in PYRAMID if size <= min(shape[:2])]
+
+def pyramid(grid: np.ndarray) -> np.ndarray:
+    """
+    coarse-to-fine summary of a (h, w, 3) grid of block averages : for every size of levels, the grid is split
+    into size x size cells of whole blocks, and every cell holds the sum and the largest of its block values,
+    per channel
+
+    :returns a (cells, 2, 3) float64 array, the cells of every level by row, one level after the other
+    """
+    grid = np.asarray(grid, dtype = np.float64)
+    h, w = grid.shape[:2]
+    res = [np.zeros((0, 2, 3))]
+    for size in levels(grid.shape):
+        rows, cols = (np.arange(size) * h) // size, (np.arange(size) * w) // size
+        sums = np.add.reduceat(np.add.reduceat(grid, rows, axis = 0), cols, axis = 1)
+        maxs = np.maximum.reduceat(np.maximum.reduceat(grid, rows, axis = 0), cols, axis = 1)
+        res.append(np.stack([sums, maxs], axis = 2).reshape(size * size, 2, 3))
+    return np.concatenate(res)
+
+
+class Budget:
+    """
+    memory budget shared by GridStacks \n
+    buffers are allocated in memory until max_bytes is reached, later ones are memory-mapped temporary files
+    in folder, so the resident size stays bounded and the page cache keeps what is used often
+    """
+    def __init__(self, max_bytes: int | None = None, folder: str | None = None) -> None:
+        self.__max_bytes = max_bytes
+        self.__folder = folder
+        self.__used = 0
+        self.__spilled = 0
+
+    def ret_used(self):
+        return self.__used
+
+    def ret_spilled(self):
+        return self.__spilled
+
+    def alloc(self, shape: tuple, dtype) -> np.ndarray:
+        nbytes = prod(shape) * np.dtype(dtype).itemsize
+        if self.__max_bytes is None or self.__used + nbytes <= self.__max_bytes:
+            self.__used += nbytes
+            return np.empty(shape, dtype = dtype)
+        self.__spilled += nbytes
+        # the file is unlinked at once, the mapping keeps its pages until the array is collected
+        with tempfile.TemporaryFile(dir = self.__folder, prefix = "duplikate_") as f:
+            return np.memmap(f, dtype = dtype, mode = "w+", shape = shape)
+
+    def release(self, arr: np.ndarray) -> None:
+        if isinstance(arr, np.memmap):
+            self.__spilled -= arr.nbytes
+        else:
+            self.__used -= arr.nbytes
+
+
+class GridStack:
+    """
+    growable stack of same-shape arrays \n
+    ret_stack is a view on the first n rows of a buffer whose capacity doubles when full,
+    so adding a grid never copies the whole stack more than log(n) times
+    """
+    def __init__(self, shape: tuple, dtype = np.float64, capacity: int = 16, budget: Budget | None = None) -> None:
+        self.__budget = Budget() if budget is None else budget
+        self.__data = self.__budget.alloc((capacity,) + tuple(shape), dtype)
+        self.__len = 0
+
+    def __len__(self):
+        return self.__len
+
+    def add(self, grid) -> int:
+        """
+        :returns the position of the grid in the stack
+        """
+        self.reserve(1)
+        self.__data[self.__len] = grid
+        self.__len += 1
+        return self.__len - 1
+
+    def extend(self, grids) -> int:
+        """
+        adds several grids at once
+
+        :returns the position of the first one, the others follow it
+        """
+        grids = np.asarray(grids)
+        self.reserve(len(grids))
+        self.__data[self.__len:self.__len + len(grids)] = grids
+        self.__len += len(grids)
+        return self.__len - len(grids)
+
+    def reserve(self, n: int) -> None:
+        if self.__len + n <= len(self.__data):
+            return
+        capacity = len(self.__data)
+        while capacity < self.__len + n:
+            capacity *= 2
+        grown = self.__budget.alloc((capacity,) + self.__data.shape[1:], self.__data.dtype)
+        grown[:self.__len] = self.__data[:self.__len]
+        self.__budget.release(self.__data)
+        self.__data = grown
+
+    def ret_stack(self) -> np.ndarray:
+        return self.__data[:self.__len]
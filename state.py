@@ -0,0 +1,107 @@
+import os
+import sqlite3
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "duplikate", "index.sqlite")
+
+
+def to_signed(h: int | None) -> int | None:
+    # SQLite integers are signed 64 bits, perceptual hashes are unsigned
+    return None if h is None else h - (1 << 64) if h >= 1 << 63 else h
+
+def to_unsigned(h: int | None) -> int | None:
+    return None if h is None else h & ((1 << 64) - 1)
+
+
+class IndexState:
+    """
+    on-disk result of the previous runs, used by RunApp.update \n
+    every image processed is recorded with its byte size, mtime, perceptual hash and whether it was kept
+    (duplicates are not), along with the duplicate pairs found. Entries are keyed by signature kind
+    (see RunApp.signature_kind) since hashes differ between modes.
+    """
+    def __init__(self, path: str = DEFAULT_PATH) -> None:
+        self.__path = path
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        # the search may run on another thread than the one that opened the store, never on two at once
+        self.__db = sqlite3.connect(path, check_same_thread = False)
+        self.__db.execute("PRAGMA journal_mode = WAL")
+        self.__db.execute("PRAGMA synchronous = NORMAL")
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "kind TEXT, path TEXT, size INTEGER, mtime INTEGER, hash INTEGER, kept INTEGER, PRIMARY KEY (kind, path))"
+        )
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS pairs ("
+            "kind TEXT, keep TEXT, duplicate TEXT, score REAL, PRIMARY KEY (kind, duplicate))"
+        )
+
+    def ret_path(self):
+        return self.__path
+
+    def files(self, kind: str, roots: list[str]) -> dict[str, tuple]:
+        """
+        :returns {absolute path: (size, mtime in ns, hash, kept)} of the recorded files under roots
+        """
+        prefixes = tuple(os.path.join(os.path.abspath(root), "") for root in roots)
+        res = {}
+        for path, size, mtime, h, kept in self.__db.execute(
+            "SELECT path, size, mtime, hash, kept FROM files WHERE kind = ?", (kind,)
+        ):
+            if path.startswith(prefixes):
+                res[path] = (size, mtime, to_unsigned(h), bool(kept))
+        return res
+
+    def put(self, kind: str, name: str, st: os.stat_result, h: int | None, kept: bool) -> None:
+        self.__db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, os.path.abspath(name), st.st_size, st.st_mtime_ns, to_signed(h), int(kept))
+        )
+
+    def pair(self, kind: str, keep: str, dup: str, score: float) -> None:
+        self.__db.execute(
+            "INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?)",
+            (kind, os.path.abspath(keep), os.path.abspath(dup), score)
+        )
+
+    def unpair(self, kind: str, dup: str) -> None:
+        self.__db.execute("DELETE FROM pairs WHERE kind = ? AND duplicate = ?", (kind, os.path.abspath(dup)))
+
+    def remove(self, kind: str, paths: list[str]) -> list[str]:
+        """
+        forgets deleted or modified files along with the pairs they belong to \n
+        the duplicates found for one of them are forgotten too, they were never compared with the other files
+
+        :returns the paths of those duplicates, to be checked again
+        """
+        dups = []
+        for path in paths:
+            dups.extend(dup for (dup,) in self.__db.execute(
+                "SELECT duplicate FROM pairs WHERE kind = ? AND keep = ?", (kind, path)
+            ))
+        gone = set(paths)
+        dups = [dup for dup in dict.fromkeys(dups) if dup not in gone]
+        rows = [(kind, path) for path in list(paths) + dups]
+        self.__db.executemany("DELETE FROM files WHERE kind = ? AND path = ?", rows)
+        self.__db.executemany("DELETE FROM pairs WHERE kind = ? AND duplicate = ?", rows)
+        self.__db.executemany("DELETE FROM pairs WHERE kind = ? AND keep = ?", rows)
+        return dups
+
+    def groups(self, kind: str) -> list[list[str]]:
+        """
+        :returns the duplicate groups found so far, each one starting with the file kept
+        """
+        res = {}
+        parent = {}
+        for keep, dup in self.__db.execute("SELECT keep, duplicate FROM pairs WHERE kind = ? ORDER BY rowid", (kind,)):
+            root = parent.get(keep, keep)
+            parent[dup] = root
+            res.setdefault(root, [root]).append(dup)
+        return list(res.values())
+
+    def flush(self) -> None:
+        self.__db.commit()
+
+    def close(self) -> None:
+        self.flush()
+        self.__db.close()
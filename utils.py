@@ -1,19 +1,52 @@
 from PIL import Image, ImageTk, UnidentifiedImageError
 import pathlib as pl
 import os
+import sys
 import tkinter as tk
 from tkinter import filedialog
 import ctypes as ct
-from math import log2, ceil, dist
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from collections import deque
+from math import log2, ceil
 import numpy as np
+from scipy.optimize import linear_sum_assignment
 import region
+import signature
+import hashindex
+import exact
+from cache import SignatureCache
+from metrics import Metrics
+from clusters import Clusters
+from cascade import Cascade, COARSE
+from state import IndexState
 
 class File:
-    def __init__(self, name: str) -> None:
+    """
+    image file, opened by Pillow as rarely as possible : the header (size, format, mode) is read at most once
+    and kept, from the decode itself when the image is decoded first, and pixels are only decoded on demand.
+    Every handle is closed before the method that opened it returns.
+    """
+    # one File is kept per image scanned, slots keep them small
+    __slots__ = ("__name", "__stat", "__size", "__format", "__mode", "__readable", "__pixels", "__buffer", "__scale",
+                 "__decode_time")
+    __ext = {1:'.jpeg', 2:'.jpg', 3:'.png', 4:'.gif', 5:'.ico', 6:'.bmp', 7:'.psd'}
+
+    def __init__(self, name: str, stat: os.stat_result | None = None) -> None:
         self.__name = name
+        self.__stat = stat
         self.__size = (0,0)
-        self.__ext = {1:'.jpeg', 2:'.jpg', 3:'.png', 4:'.gif', 5:'.ico', 6:'.bmp', 7:'.psd'}
+        self.__format = None
+        self.__mode = None
+        # None until the header was read, then whether Pillow could read it
+        self.__readable = None
         self.__pixels = []
+        # buffer the pixels held were decoded for, None when there are none
+        self.__buffer = None
+        self.__scale = 1
+        # seconds spent in the last pixel_list call
+        self.__decode_time = 0.0
     
     def ret_name(self):
         return self.__name
@@ -23,27 +56,83 @@ class File:
     
     def ret_size(self):
         return self.__size
+
+    def ret_format(self):
+        return self.__format
+
+    def ret_mode(self):
+        return self.__mode
+
+    def ret_scale(self):
+        return self.__scale
+
+    def ret_decode_time(self):
+        return self.__decode_time
+
+    def ret_header(self) -> tuple | None:
+        """
+        :returns (size, format, mode) when the header was read, None else
+        """
+        return (self.__size, self.__format, self.__mode) if self.__readable else None
+
+    def set_header(self, header: tuple) -> None:
+        """
+        takes the header read somewhere else, by a worker process decoding the same file
+        """
+        self.__size, self.__format, self.__mode = header
+        self.__readable = True
+
+    def ret_stat(self) -> os.stat_result:
+        """
+        stat result of the file, the one taken while scanning the folder when there was one
+        """
+        if self.__stat is None:
+            self.__stat = os.stat(self.__name)
+        return self.__stat
+
+    def open(self) -> Image.Image:
+        """
+        opens the image and records its header, to be used as a context manager so the handle is closed
+        """
+        img = Image.open(self.__name)
+        self.__size, self.__format, self.__mode = img.size, img.format, img.mode
+        self.__readable = True
+        return img
+
+    def header(self) -> bool:
+        """
+        reads the header of the image unless it was already read, nothing is decoded
+
+        :returns true if Pillow can read the image
+        """
+        if self.__readable is None:
+            try:
+                with self.open():
+                    pass
+            except (OSError, UnidentifiedImageError):
+                self.__readable = False
+        return self.__readable
     
     def exists(self) -> bool:
         """
         checks if file exists \n
         supported error in case of not existing : \n
-        FileNotFoundError, FileExistsError, UnidentifiedImageError
+        FileNotFoundError, FileExistsError, UnidentifiedImageError \n
+        the answer is the one of the first open of the file
 
         :return true if yes, false else
         """
-        try:
-            file = Image.open(self.__name)
-        except FileNotFoundError or FileExistsError or UnidentifiedImageError:
-            return False
-        return True
+        return self.header()
     
     def size_get(self) -> None:
         """
         changes self.size to the size of the image
         """
-        img = Image.open(self.__name)
-        self.__size = img.size
+        if self.__readable is None:
+            with self.open():
+                pass
+        elif not self.__readable:
+            raise FileNotFoundError(f"{self.__name} can't be read as an image")
     
     def is_image(self) -> bool:
         """
@@ -57,54 +146,117 @@ class File:
                 break
         return res
 
-    def pixel_list(self) -> None:
+    def pixel_list(self, buffer: int = 1) -> None:
         """
-        changes self.__pixels to the list of average RGB byte value of every pixel in the image
+        changes self.__pixels to an (height, width, 3) uint8 array of the RGB values of every pixel in the image \n
+        with buffer > 1 the decoder may scale the image down by self.__scale, a power of two dividing buffer.
+        Nothing is decoded again while the pixels of the same buffer are held
         """
-        self.size_get()
-        img = Image.open(self.__name)
-        self.__pixels = [ [0 for i in range(self.__size[1])] for j in range(self.__size[0]) ]
-        for x in range(self.__size[0]):
-            for y in range(self.__size[1]):
-                pix = img.getpixel((x, y))
-                self.__pixels[x][y] = pix
-            
+        if self.__buffer == buffer:
+            return
+        start = time.perf_counter()
+        with self.open() as img:
+            if buffer > 1:
+                self.__pixels, self.__scale, _ = signature.decode_reduced_image(img, buffer)
+            else:
+                self.__pixels = signature.decode_image(img)
+                self.__scale = 1
+        self.__buffer = buffer
+        self.__decode_time = time.perf_counter() - start
+
+    def drop_pixels(self) -> None:
+        self.__pixels = []
+        self.__buffer = None
+
+    def thumbnail(self, height: int) -> Image.Image:
+        """
+        :returns the image scaled to height pixels high, JPEG files are scaled down by the decoder on the way
+        """
+        with self.open() as img:
+            width = int(img.size[0] * height / img.size[1])
+            img.draft(None, (width, height))
+            return img.resize((width, height))
+
 class Folder:
-    def __init__(self, path: str | None = None) -> None:
+    def __init__(self, path: str | list[str] | None = None) -> None:
         self.__path: str = path
-        self.__content: list[str] = []
+        # every directory scanned, path may hold several of them
+        self.__roots: list[str] = Folder.distinct([] if path is None else [path] if isinstance(path, str) else list(path))
         self.__images: list[File] = []
     
-    def ret_content(self):
-        return self.__content
-    
     def ret_images(self) -> list[File]: 
         return self.__images
     
     def ret_path(self):
         return self.__path
+
+    def ret_roots(self):
+        return self.__roots
+
+    def distinct(roots: list[str]) -> list[str]:
+        """
+        resolves the roots and drops the ones given twice or lying inside another one,
+        so that no file is scanned twice (it would be found as an exact copy of itself)
+        """
+        paths = [os.path.realpath(root) for root in roots if root != ""]
+        res = []
+        for path in paths:
+            if path in res:
+                continue
+            if any(os.path.commonpath([path, other]) == other for other in paths if other != path):
+                continue
+            res.append(path)
+        return res
     
-    def get_content(self) -> None:
+    def entries(self, recursive: bool = True):
         """
-        gets all files in the specified directory
+        walks every root with os.scandir and yields the os.DirEntry of its images lazily,
+        by name within a directory and depth first
         """
-        try:    
-            self.__content = os.listdir(self.__path)
-        except FileNotFoundError:
-            ct.windll.user32.MessageBoxW(0, "No directory specified !", "Error", 0)
-        else:
-            self.__content = os.listdir(self.__path)
+        for root in self.__roots:
+            dirs = [root]
+            while dirs:
+                try:
+                    with os.scandir(dirs.pop()) as it:
+                        entries = sorted(it, key = lambda entry: entry.name)
+                except OSError:
+                    continue
+                subdirs = []
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks = False):
+                            if recursive:
+                                subdirs.append(entry.path)
+                        elif entry.is_file() and File(entry.path).is_image():
+                            yield entry
+                    except OSError:
+                        pass
+                dirs.extend(reversed(subdirs))
+
+    def scan(self, recursive: bool = True):
+        """
+        yields the images of every root lazily, in the order of entries \n
+        the stat result of each image is kept on its File for the later stages
+        """
+        for entry in self.entries(recursive):
+            try:
+                yield File(entry.path, entry.stat())
+            except OSError:
+                pass
+
+    def count(self, recursive: bool = True) -> int:
+        """
+        :returns the number of images scan would yield, without the stat calls
+        """
+        return sum(1 for _ in self.entries(recursive))
     
     def det_images(self):
         """
-        uses self.__content to determine self.__images 
+        scans the roots to determine self.__images 
 
         :returns nothing, modifies self.__images
         """
-        for i in self.__content:
-            f = File( (self.__path if self.__path != None else "") + "/" + i)
-            if f.is_image():
-                self.__images.append(f)
+        self.__images.extend(self.scan())
 
     def check_by_pix(self, ind: int) -> list[int]:
         """
@@ -123,193 +275,188 @@ class Folder:
             if im_data.ret_size() == im_data2.ret_size(): 
                 im_data2.pixel_list()
                 pix2 = im_data2.ret_pixels()
-                if pix == pix2:
+                if np.array_equal(pix, pix2):
                     print("image", i, "is a duplicate")
                     duplicates.append(im_data2)
                 else:
                     print("image", i, "is not a duplicate")
         return duplicates
 
-    def sum_of_t(self, t1, t2):
-        if len(t1) == 2:
-            return (t1[0] + t2[0], t1[1] + t2[1])
-        elif len(t1) == 3:
-            return (t1[0] + t2[0], t1[1] + t2[1], t1[2] + t2[2])
-
-    def convolution(self, img1: File, buffer: int):
+    def reduce_im(self, dups: list[File] = []) -> None:
         """
-        Creates a list of kernels by downsampling the image.
-        Each kernel represents a BufferxBuffer block (Buffer² pixels).
+        drops the first image, done with by check_by_pix, and the duplicates confirmed for it,
+        which are never compared again
         """
-        img1.pixel_list()
-        tabpix = img1.ret_pixels()
-        w, h = img1.ret_size()
+        self.__images = [im for im in self.__images[1:] if im not in dups]
 
-        # step = buffer because we group Buffer×Buffer pixels
-        conv = [[] for _ in range(0, h, buffer)]
+    def convolution(self, img1: File, buffer: int, reduced: bool = False) -> np.ndarray:
+        """
+        Creates a grid of kernels by downsampling the image.
+        Each kernel represents a BufferxBuffer block (Buffer² pixels),
+        conv[i][j] is the (r, g, b) average of the block on row i, column j, in float32.
+        With reduced, the image is decoded at a lower scale when the format allows it,
+        the grid keeps the same shape but its values differ, and so do the scores computed from it.
+        """
+        img1.pixel_list(buffer if reduced else 1)
+        conv = signature.block_means(img1.ret_pixels(), buffer // img1.ret_scale())
+        # the File outlives the signature, the decoded image must not
+        img1.drop_pixels()
+        return conv.astype(np.float32)
+    
+    def fast_find(self, conv1: list, conv2: list, img1: File, img2: File, limit: float = 5.0):
+        """
+        determines if two images are the same or not  \n
+        two cases -> same size or different sizes
+        (approximated accuracy : 98.98% / set accuracy : 95% (can be changed with limit))
 
-        for i in range(0, h, buffer):
-            for j in range(0, w, buffer):
+        :returns true if detected same, false else
+        """
+        if (img1.ret_size() == img2.ret_size()):
+            # the exact score is not needed, the comparison can stop as soon as limit is reached
+            return bool(self.early_scores(np.asarray(conv1)[None], conv2, limit)[0][0] < limit)
+        return self.fast_score(conv1, conv2, img1, img2) < limit
 
-                ker_r = 0
-                ker_g = 0
-                ker_b = 0
-                nbpi = 0
+    def fast_score(self, conv1: list, conv2: list, img1: File, img2: File) -> float:
+        """
+        per channel difference between two images used by fast_find \n
+        same size -> average relative difference of the kernels,
+        different sizes -> difference of their fixed-size descriptors (see descriptor_scores)
 
-                # iterate through Buffer×Buffer block (Buffer² pixels)
-                for di in range(buffer):
-                    for dj in range(buffer):
-                        y = i + di
-                        x = j + dj
+        :returns the largest channel difference, in percent
+        """
+        if (img1.ret_size() == img2.ret_size()):
+            return float(self.fast_scores(np.asarray(conv1)[None], conv2)[0])
+        desc1, desc2 = signature.descriptor(np.asarray(conv1)), signature.descriptor(np.asarray(conv2))
+        return float(self.descriptor_scores(desc1[None], desc2[None])[0, 0])
 
-                        if y < h and x < w:
-                            r, g, b = tabpix[x][y][:3]  # pixel format expected: (r,g,b)
+    def fast_scores(self, convs1: np.ndarray, conv2: np.ndarray) -> np.ndarray:
+        """
+        fast_score of a stack of n same-size grids against another grid of that size, in one pass \n
+        per kernel and channel : 1 if only one value is 0, else |v2 - v1| / v1
 
-                            ker_r += int(r)
-                            ker_g += int(g)
-                            ker_b += int(b)
-                            nbpi += 1
+        :returns an (n,) array of the largest channel difference, in percent
+        """
+        conv1 = np.asarray(convs1, dtype = np.float64)
+        difs = self.rel_diffs(conv1, conv2).sum(axis = (1, 2)) / (conv1.shape[1] * conv1.shape[2]) * 100
+        return difs.max(axis = 1)
 
-                # normalize if we collected any pixel
-                if nbpi > 0:
-                    ker = (ker_r / nbpi, ker_g / nbpi, ker_b / nbpi)
-                    conv[i // buffer].append(ker)
+    def rel_diffs(self, convs1: np.ndarray, conv2: np.ndarray) -> np.ndarray:
+        """
+        :returns the per kernel and channel terms of fast_scores, all of them in [0, 1] or above
+        """
+        conv1 = np.asarray(convs1, dtype = np.float64)
+        conv2 = np.asarray(conv2, dtype = np.float64)[None]
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            rel = np.abs(conv2 - conv1) / conv1
+        return np.where((conv1 == 0) != (conv2 == 0), 1.0, np.where(conv1 == conv2, 0.0, rel))
 
-        return conv
-    
-    def fast_find(self, conv1: list, conv2: list, img1: File, img2: File):
+    def early_scores(self, convs1: np.ndarray, conv2: np.ndarray, limit: float,
+                     pyrs1: np.ndarray | None = None, pyr2: np.ndarray | None = None) -> tuple:
         """
-        determines if two images are the same or not  \n
-        two cases -> same size or different sizes
-        (approximated accuracy : 98.98% / set accuracy : 95% (can be changed))
+        fast_scores with an early exit at limit, the grids of candidates that can't score under it are not read
+        in full \n
+        a cell of the pyramids (see signature.pyramid) bounds its kernels from below : each term of fast_scores
+        is at least |v2 - v1| / m, m being the largest value of the cell in either grid, so the whole cell
+        at least |sum2 - sum1| / m. Candidates whose bound reaches limit at one level are dropped there,
+        coarsest first. The others are compared on rows of kernels, 1, 2, 4 ... at a time, and dropped as soon
+        as the terms summed so far reach limit, since none of them is negative.
 
-        :returns true if detected same, false else
+        :returns (scores, stages) of the n candidates : the score is exact under limit, else a lower bound
+        of it reaching limit. stages[n] is the index in signature.levels of the level that dropped candidate n,
+        len(levels) if it was dropped within the full grid, -1 if it was compared in full
         """
-        res: bool = False
-        if (img1.ret_size() == img2.ret_size()):
-            dif0, dif1, dif2 = 0, 0, 0
-            for i in range (len(conv1)):
-                for j in range (len(conv1[i])):
-                    if (conv1[i][j][0] == 0 and conv2[i][j][0] != 0) or (conv1[i][j][0] != 0 and conv2[i][j][0] == 0):
-                        dif0 += 1
-                    elif conv1[i][j][0] == conv2[i][j][0]:
-                        pass
-                    else:
-                        dif0 += abs(conv2[i][j][0] - conv1[i][j][0]) / conv1[i][j][0]
+        conv2 = np.asarray(conv2, dtype = np.float64)
+        h, w = conv2.shape[:2]
+        scale = 100 / (h * w)
+        scores = np.zeros(len(convs1))
+        stages = np.full(len(convs1), -1)
+        active = np.arange(len(convs1))
 
-                    if (conv1[i][j][1] == 0 and conv2[i][j][1] != 0) or (conv1[i][j][1] != 0 and conv2[i][j][1] == 0):
-                        dif1 +=1
-                    elif  conv1[i][j][1] == conv2[i][j][1]:
-                        pass
-                    else:
-                        dif1 += abs(conv2[i][j][1] - conv1[i][j][1]) / conv1[i][j][1]
+        if pyrs1 is not None and pyr2 is not None:
+            start = 0
+            for stage, size in enumerate(signature.levels(conv2.shape)):
+                cells = slice(start, start + size * size)
+                start += size * size
+                sums1, maxs1 = pyrs1[active, cells, 0], pyrs1[active, cells, 1]
+                den = np.maximum(maxs1, pyr2[None, cells, 1])
+                with np.errstate(divide = "ignore", invalid = "ignore"):
+                    part = np.where(den > 0, np.abs(pyr2[None, cells, 0] - sums1) / den, 0.0)
+                bounds = (part.sum(axis = 1) * scale).max(axis = 1)
+                out = bounds >= limit
+                scores[active[out]], stages[active[out]] = bounds[out], stage
+                active = active[~out]
 
-                    if (conv1[i][j][2] == 0 and conv2[i][j][2] != 0) or (conv1[i][j][2] != 0 and conv2[i][j][2] == 0):
-                        dif2 += 1
-                    elif  conv1[i][j][2] == conv2[i][j][2]:
-                        pass
-                    else:
-                        dif2 += abs(conv2[i][j][2] - conv1[i][j][2]) / conv1[i][j][2]
+        sums = np.zeros((len(active), 3))
+        row, step = 0, 1
+        while row < h and len(active) > 0:
+            rel = self.rel_diffs(convs1[active, row:row + step], conv2[row:row + step])
+            sums += rel.sum(axis = (1, 2))
+            row, step = row + step, 2 * step
+            partial = (sums * scale).max(axis = 1)
+            out = partial >= limit if row < h else np.zeros(len(active), dtype = bool)
+            scores[active] = partial
+            stages[active[out]] = len(signature.levels(conv2.shape))
+            active, sums = active[~out], sums[~out]
+        return scores, stages
 
-            dif0 = (dif0 / ( len(conv1) * len(conv1[0]) ) ) * 100
-            dif1 = (dif1 / ( len(conv1) * len(conv1[0]) ) ) * 100
-            dif2 = (dif2 / ( len(conv1) * len(conv1[0]) ) ) * 100
-            if dif0 < 5.0 and dif1 < 5.0 and dif2 < 5.0:
-                res = True
-        else:    
-            r1, g1, b1, r2, g2, b2 = 0, 0, 0, 0, 0, 0
-            for i in range(0, len(conv1)):
-                for j in range(0, len(conv1[i])):
-                    r1 += conv1[i][j][0]
-                    g1 += conv1[i][j][1]
-                    b1 += conv1[i][j][2]
-            r1 = r1 / (len(conv1) * len(conv1[0]))
-            g1 = g1 / (len(conv1) * len(conv1[0]))
-            b1 = b1 / (len(conv1) * len(conv1[0]))
-            for i in range(0, len(conv2)):
-                for j in range(len(conv2[i])):
-                    r2 += conv2[i][j][0]
-                    g2 += conv2[i][j][1]
-                    b2 += conv2[i][j][2]
-            r2 = r2 / (len(conv2) * len(conv2[0]))
-            g2 = g2 / (len(conv2) * len(conv2[0]))
-            b2 = b2 / (len(conv2) * len(conv2[0]))
-            difR, difB, difG = (r2 - r1)/r1*100, (b2 - b1)/b1*100, (g2 - g1)/g1*100
-            if -5.0 < difR < 5.0 and -5.0 < difB < 5.0 and -5.0 < difG < 5.0:
-                res = True
+    def descriptor_scores(self, descs1: np.ndarray, descs2: np.ndarray) -> np.ndarray:
+        """
+        fast_score between every pair of an (n, DESC_SIZE) and an (m, DESC_SIZE) stack of descriptors,
+        computed block by block to bound the memory used \n
+        the larger of : the largest channel difference of the grid cells, as fast_scores computes it,
+        and the share of blocks that changed colour bin in the histograms
+
+        :returns an (n, m) array, in percent
+        """
+        cells = signature.DESC_GRID * signature.DESC_GRID
+        grid1 = np.asarray(descs1[:, :3 * cells], dtype = np.float64).reshape(len(descs1), cells, 3)
+        grid2 = np.asarray(descs2[:, :3 * cells], dtype = np.float64).reshape(len(descs2), cells, 3)
+        hist1 = np.asarray(descs1[:, 3 * cells:], dtype = np.float64)
+        hist2 = np.asarray(descs2[:, 3 * cells:], dtype = np.float64)
+
+        res = np.empty((len(descs1), len(descs2)))
+        step = max(1, (1 << 22) // max(1, len(descs2) * 3 * cells))
+        for start in range(0, len(descs1), step):
+            # (step, 1, cells, 3) against (1, m, cells, 3)
+            rel = self.rel_diffs(grid1[start:start + step, None], grid2)
+            difs = (rel.sum(axis = 2) / cells * 100).max(axis = 2)
+            moved = np.abs(hist1[start:start + step, None] - hist2[None]).sum(axis = 2) / 2 * 100
+            res[start:start + step] = np.maximum(difs, moved)
         return res
-    
+
     def dist_center_regions(self, rg1: region.Region, rg2: region.Region):
-        center1, center2 = (0, 0), (0, 0)
-        for i in range ( len(rg1.group) if len(rg1.group) >= len(rg2.group) else len(rg2.group)):
-            if i < len(rg1.group):
-                center1 = self.sum_of_t(center1, rg1.group[i])
-            if i < len(rg2.group):
-                center2 = self.sum_of_t(center2, rg2.group[i])
-        center1 = (center1[0] / len(center1), center1[1] / len(center1))
-        center2 = (center2[0] / len(center2), center2[1] / len(center2))
-        return dist(center1, center2)
+        return float(np.linalg.norm(rg1.centroid - rg2.centroid))
     
-    def accurate_find(self, rgs1: list[region.Region], rgs2: list[region.Region]):
+    def accurate_find(self, rgs1: list[region.Region] | region.RegionSet, rgs2: list[region.Region] | region.RegionSet):
+        rgs1, rgs2 = region.RegionSet.of(rgs1), region.RegionSet.of(rgs2)
         #penalty for the number of region behind different from one image to the other
         rgs_nbr_pen = abs(len(rgs1) - len(rgs2)) * -0.1
 
-        # Couples making of regions
+        # Couples making of regions : every region of the smaller list gets a distinct region of the other one,
+        # the pairing minimizing the total distance between average colours
         nbr_comp = min(len(rgs1), len(rgs2))
         base = True if nbr_comp == len(rgs1) else False
-        couples = []
-        skip = []
-        for i in range(nbr_comp):
-            corres = 1000000
-            ind = 0
-            if base:
-                for j in range(len(rgs2)):
-                    if dist(rgs1[i].avg, rgs2[j].avg) < corres and rgs2[j] not in skip:
-                        corres = dist(rgs1[i].avg, rgs2[j].avg)
-                        ind = j
-                couples.append((rgs1[i], rgs2[ind]))
-                skip.append(rgs2[ind])
-            else:
-                for j in range(len(rgs1)):
-                    if dist(rgs2[i].avg, rgs1[j].avg) < corres and rgs1[j] not in skip:
-                        corres = dist(rgs2[i].avg, rgs1[j].avg)
-                        ind = j
-                couples.append((rgs2[i], rgs1[ind]))
-                skip.append(rgs1[ind])
-        
-        #IoU determination
-        def region_iou_normalized(rA: region.Region, rB: region.Region, resolution=256):
-            g_norm1, g_norm2 = [(pix[0]/rA.dims[0], pix[1]/rA.dims[1]) for pix in rA.group], [(pix[0]/rB.dims[0], pix[1]/rB.dims[1]) for pix in rB.group]
-            (x_max1, y_max1) = (max(pix[0] for pix in g_norm1), max(pix[1] for pix in g_norm1))
-            (x_min1, y_min1) = (min(pix[0] for pix in g_norm1), min(pix[1] for pix in g_norm1))
-            (x_max2, y_max2) = (max(pix[0] for pix in g_norm2), max(pix[1] for pix in g_norm2))
-            (x_min2, y_min2) = (min(pix[0] for pix in g_norm2), min(pix[1] for pix in g_norm2))
-            x_min_score = abs(x_min1 - x_min2)
-            y_min_score = abs(y_min1 - y_min2)
-            x_max_score = abs(x_max1 - x_max2)
-            y_max_score = abs(y_max1 - y_max2)
-            return x_min_score + x_max_score + y_min_score + y_max_score
-        
-        IoU_score = 0
-        Centroid_score = 0
-        r1, g1, b1, r2, g2, b2 = 0, 0, 0, 0, 0, 0
-        dmax = (rgs1[0].dims[0]*rgs1[0].dims[0] + rgs1[0].dims[1]*rgs1[0].dims[1])**5 if base else (rgs2[0].dims[0]*rgs2[0].dims[0] + rgs2[0].dims[1]*rgs2[0].dims[1])**5
-        for i in range(len(couples)):
-            r1 += rgs1[i].avg[0] 
-            g1 += rgs1[i].avg[1] 
-            b1 += rgs1[i].avg[2]
-            r2 += rgs2[i].avg[0] 
-            g2 += rgs2[i].avg[1] 
-            b2 += rgs2[i].avg[2] 
-            IoU_score += region_iou_normalized(couples[i][0], couples[i][1])
-            dist_center = self.dist_center_regions(couples[i][0], couples[i][1])
-            if dist_center != 0.0:
-                Centroid_score += 1 - min(dist_center/dmax, 1)
-
-        Centroid_score /= len(rgs2) if base else len(rgs1)
-        IoU_score /= nbr_comp 
-        red_score, green_score, blue_score = abs(r1 - r2) / (100*len(couples)), abs(g1 - g2) / (100*len(couples)), abs(b1 - b2) / (100*len(couples))
-        total = round((rgs_nbr_pen - Centroid_score - IoU_score - red_score - green_score - blue_score), 3)
+        small, large = (rgs1, rgs2) if base else (rgs2, rgs1)
+        avg_s = small.ret_avgs()
+        avg_l = large.ret_avgs()
+        cost = np.sqrt(((avg_s[:, None, :] - avg_l[None, :, :]) ** 2).sum(axis = 2))
+        rows, cols = linear_sum_assignment(cost)
+
+        #IoU determination, on the normalized bounding boxes
+        bbox_s = small.ret_bboxes()[rows]
+        bbox_l = large.ret_bboxes()[cols]
+        IoU_score = np.abs(bbox_s - bbox_l).sum() / nbr_comp
+
+        cent_s = small.ret_centroids()[rows]
+        cent_l = large.ret_centroids()[cols]
+        dist_center = np.linalg.norm(cent_s - cent_l, axis = 1)
+        dmax = (small.dims[0]*small.dims[0] + small.dims[1]*small.dims[1])**5
+        Centroid_score = (1 - np.minimum(dist_center[dist_center != 0.0] / dmax, 1)).sum() / len(large)
+
+        r1, g1, b1 = rgs1.ret_avgs()[:nbr_comp].sum(axis = 0)
+        r2, g2, b2 = rgs2.ret_avgs()[:nbr_comp].sum(axis = 0)
+        red_score, green_score, blue_score = abs(r1 - r2) / (100*nbr_comp), abs(g1 - g2) / (100*nbr_comp), abs(b1 - b2) / (100*nbr_comp)
+        total = round(float(rgs_nbr_pen - Centroid_score - IoU_score - red_score - green_score - blue_score), 3)
         return total
 
 class UI:
@@ -378,7 +525,7 @@ class UI:
 
         return path.get()
 
-    def comp_wind(self, im1: str, im2: str):
+    def comp_wind(self, im1: str | File, im2: str | File):
         self.wind = tk.Tk()
         self.wind.geometry("1000x600")
         self.wind.title("Comparison Window")
@@ -389,19 +536,11 @@ class UI:
         self.wind.geometry(f'{1000}x{600}+{x}+{y}')
 
 
-        img_data1 = Image.open(im1)
-        prop1 = img_data1.size
-        ratio1 = 250/prop1[1]
-        width1 = int(prop1[0]*ratio1)
-        img_data1 = img_data1.resize((width1, 250))
+        img_data1 = (im1 if isinstance(im1, File) else File(im1)).thumbnail(250)
         item1 = ImageTk.PhotoImage(img_data1)
         ImLabel1 = tk.Label(self.wind, image = item1)
 
-        img_data2 = Image.open(im2)
-        prop2 = img_data2.size
-        ratio2 = 250/prop2[1]
-        width2 = int(prop2[0]*ratio2)
-        img_data2 = img_data2.resize((width2, 250))
+        img_data2 = (im2 if isinstance(im2, File) else File(im2)).thumbnail(250)
         item2 = ImageTk.PhotoImage(img_data2)
         ImLabel2 = tk.Label(self.wind, image = item2)
 
@@ -423,28 +562,59 @@ class UI:
         self.wind.mainloop()
 
 class RunApp:
-    def __init__(self, mode):
+    def __init__(self, mode, cache: SignatureCache | None = None, hash_dist: int | None = hashindex.DEFAULT_DIST, jobs: int = 1,
+                 max_diff: float = 5.0, min_score: float = -1.0, path: str | list[str] | None = None, reduced: bool = False,
+                 metrics: Metrics | None = None, memory: int | None = None, spill_dir: str | None = None,
+                 cascade: Cascade | None = None):
         self.ui = UI()
         self.folder = None
+        # asked in the start menu when None
+        self.path = path
         self.mode = mode
+        self.cache = cache
+        # None compares every pair of images
+        self.hash_dist = hash_dist
+        self.jobs = jobs
+        # fast mode : largest channel difference in percent, accurate mode : lowest accurate_find score
+        self.max_diff = max_diff
+        self.min_score = min_score
+        # accurate mode : filters run before accurate_find, by default the ones that can't miss a match
+        self.cascade = Cascade(min_score = min_score) if cascade is None else cascade
+        # decode images at a scale matched to the signature (see Folder.convolution)
+        self.reduced = reduced
+        # stage timers, counters and progress reports, silent unless given a stream
+        self.metrics = Metrics() if metrics is None else metrics
+        # bytes of signatures held in memory, the next ones are memory-mapped in spill_dir (None for no limit)
+        self.memory = memory
+        self.spill_dir = spill_dir
+        # comparison state, filled by run
+        self.scanned = 0
+        self.buckets = {}
+        self.descs = None
+        # results of the previous runs, only set by update
+        self.state = None
     
     def get_path(self):
-        self.folder = Folder(self.ui.start_menu())
+        self.folder = Folder(self.path if self.path is not None else self.ui.start_menu())
 
     def pixel_by_pixel(self):
-        self.folder.get_content()
+        """
+        pixel-exact search : the first image left is compared with all the others, its confirmed duplicates
+        join its group and leave the list with it
+        """
         self.folder.det_images()
-        numb_im = len(self.folder.ret_images()) - 1
-        while numb_im != 0:
-            dups = self.folder.check_by_pix(0)
-            for i in range(len(dups)):
-                self.ui.comp_wind(self.folder.ret_images()[0].ret_name(), dups[i].ret_name())
-                if self.ui.action_id == 1:
+        self.clusters = Clusters()
+        while len(self.folder.ret_images()) > 1:
+            first = self.folder.ret_images()[0]
+            confirmed = []
+            for dup in self.folder.check_by_pix(0):
+                if self.review(first, dup, 0.0, exact = True):
                     print("duplicate found")
+                    self.clusters.union(first.ret_name(), dup.ret_name())
+                    confirmed.append(dup)
                 else:
                     print("not a duplicate")
-            numb_im -= 1
-            self.folder.reduce_im()
+            self.folder.reduce_im(confirmed)
         
     def progression(self):
         """
@@ -452,80 +622,505 @@ class RunApp:
         """
         return (len(self.folder.ret_images())-1)*len(self.folder.ret_images()) // 2
 
-    def region_det(self, name_img) -> list[region.Region]:
-        img_f = File(name_img)
-        arr = []
-        for i in range(1):
-            convu = self.folder.convolution(img1 = img_f, buffer = 16)
-            convu = [row for row in convu if len(row) > 0]
-
-            arr = np.array(convu, dtype=np.float32)
-            arr = arr.astype(np.uint8)
-            img_res = Image.fromarray(arr, mode = 'RGB')
-            fol = pl.Path("temp")
-            fol.mkdir(exist_ok = True)
-            img_res.save("temp/temp.png")
-            img_f = File("temp/temp.png")
-
-        img_f.size_get()
-
-        regions: list[region.Region] = []
-        for i in range(len(arr)): 
-            for j in range(len(arr[i])):
-                verif = False
-                for k in range(len(regions)):
-                    if dist(arr[i][j], regions[k].avg) <= 50:
-                        regions[k].group.append((i, j))
-                        verif = True
-                        break
-                if not verif:
-                    new_rg = region.Region(img_f.ret_size())
-                    new_rg.group.append((i, j))
-                    regions.append(new_rg)
-                    regions = region.Region.avg_clrs(regions, arr)
-        
-        img_res.close()
-        os.remove("temp/temp.png")
-        return regions
+    def region_det(self, name_img: str | File) -> list[region.Region]:
+        """
+        splits an image into regions of close colour, on its 16x16 kernels truncated to bytes \n
+        everything stays in memory, so it can run from several threads or processes at once
+        """
+        img = name_img if isinstance(name_img, File) else File(name_img)
+        convu = self.folder.convolution(img1 = img, buffer = 16, reduced = self.reduced)
+        arr = convu.astype(np.float32).astype(np.uint8)
+        return region.Region.cluster(arr, 50)
+
+    def signature_kind(self) -> tuple:
+        """
+        :returns (kind, buffer) of the signature used by the current mode
+        """
+        kind, buffer = ("conv", 4) if self.mode == "F" else ("regions", 16)
+        return (kind + "-reduced" if self.reduced else kind), buffer
+
+    def cached(self, im: File):
+        """
+        :returns the cached signature of an image, None if there is no valid one
+        """
+        if self.cache is None:
+            return None
+        kind, buffer = self.signature_kind()
+        sig = self.cache.get(im.ret_name(), kind, buffer, im.ret_stat())
+        if sig is not None:
+            self.metrics.count("cache_hits")
+            im.size_get()
+        return sig
+
+    def store(self, im: File, sig) -> None:
+        if self.cache is not None:
+            kind, buffer = self.signature_kind()
+            self.cache.put(im.ret_name(), kind, buffer, sig, im.ret_stat())
+
+    def signature(self, im: File):
+        """
+        computes the signature used by the current mode (conv grid for F, regions for A) \n
+        a valid cached signature is reused instead of decoding the image again
+        """
+        sig = self.cached(im)
+        if sig is not None:
+            return sig
+
+        kind, buffer = self.signature_kind()
+        start = time.perf_counter()
+        if self.mode == "F":
+            sig = self.folder.convolution(im, buffer, self.reduced)
+        else:
+            sig = self.region_det(im)
+        self.extracted(im.ret_decode_time(), time.perf_counter() - start)
+        self.store(im, sig)
+        return sig
+
+    def extracted(self, decode: float, seconds: float) -> None:
+        """
+        records the extraction of one signature, decode being the part of seconds spent decoding
+        """
+        self.metrics.count("extracted")
+        self.metrics.add_time("decode", decode)
+        self.metrics.add_time("signature", seconds - decode)
+
+    def signed(self, files):
+        """
+        yields (file, signature) in input order, reading files lazily \n
+        with jobs > 1 cache misses go to a process pool, up to 4 * jobs of them being extracted
+        while the caller works on the earlier ones. Files that can't be decoded are reported and skipped
+        """
+        pool = ProcessPoolExecutor(max_workers = self.jobs) if self.jobs > 1 else None
+        pending = deque()
+        try:
+            for im in files:
+                try:
+                    sig = self.cached(im)
+                    if sig is None:
+                        if pool is not None:
+                            sig = pool.submit(extract_signature, im.ret_name(), self.mode, self.reduced)
+                        else:
+                            sig = self.signature(im)
+                except (OSError, UnidentifiedImageError) as e:
+                    self.unreadable(im, e)
+                    continue
+                pending.append((im, sig))
+                while pending and (len(pending) > 4 * self.jobs or not isinstance(pending[0][1], Future)
+                                   or pending[0][1].done()):
+                    res = self.received(*pending.popleft())
+                    if res is not None:
+                        yield res
+            while pending:
+                res = self.received(*pending.popleft())
+                if res is not None:
+                    yield res
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures = True)
+            if self.cache is not None:
+                self.cache.flush()
+
+    def received(self, im: File, sig) -> tuple | None:
+        """
+        turns the result of extract_signature back into a signature, and caches it
+
+        :returns (file, signature), None if the worker could not decode the file
+        """
+        if not isinstance(sig, Future):
+            return im, sig
+        try:
+            sig, header, decode, seconds = sig.result()
+        except (OSError, UnidentifiedImageError) as e:
+            self.unreadable(im, e)
+            return None
+        self.extracted(decode, seconds)
+        # the worker read the header while decoding, the file is not opened again here
+        im.set_header(header)
+        if self.mode != "F":
+            sig = region.Region.from_labels(*sig)
+        self.store(im, sig)
+        return im, sig
+
+    def unreadable(self, im: File, error: Exception) -> None:
+        """
+        reports a file that can't be decoded, the run goes on without it
+        """
+        print(f"could not read {im.ret_name()} : {error}", file = sys.stderr)
+        self.metrics.count("unreadable")
+        self.metrics.count("images")
+
+    def unique(self, files):
+        """
+        yields the files that are not byte-identical to an earlier one \n
+        copies are reviewed against the first file on the way, without being decoded. When the first file
+        was itself removed as a duplicate, the copy is yielded too : it is compared with the files kept
+        like any other image, so it is reported against the file kept for its group, with a real score
+        """
+        for im in files:
+            self.scanned += 1
+            self.metrics.count("scanned")
+            try:
+                with self.metrics.timer("exact"):
+                    first = self.exact.add(im.ret_name(), im.ret_stat().st_size)
+            except OSError:
+                self.metrics.count("images")
+                continue
+            if first is None or self.clusters.find(first) != first:
+                yield im
+            else:
+                self.metrics.count("exact")
+                with self.metrics.timer("review"):
+                    removed = self.review(File(first), im, 0.0, exact = True)
+                if removed:
+                    self.clusters.union(first, im.ret_name())
+                    self.record_pair(first, im.ret_name(), 0.0)
+                self.record(im, None, not removed)
+                self.metrics.count("images")
+
+    def phash(self, sig) -> int:
+        """
+        perceptual hash of a signature, regions are painted back with their average colour first
+        """
+        if self.mode == "F":
+            return hashindex.phash(sig)
+        labels, avgs = region.Region.to_labels(sig, (sig[0].dims[1], sig[0].dims[0]))
+        return hashindex.phash(avgs[labels])
+
+    def compare(self, im1: File, im2: File, sig1, sig2) -> tuple:
+        """
+        runs the comparison of the current mode on two images and their signatures
+
+        :returns (is duplicate, score)
+        """
+        if self.mode == "F":
+            score = self.folder.fast_score(conv1 = sig1, conv2 = sig2, img1 = im1, img2 = im2)
+            return score < self.max_diff, score
+        score = self.folder.accurate_find(rgs1 = sig1, rgs2 = sig2)
+        return score > self.min_score, score
+
+    def bucket_add(self, i: int, im: File, conv) -> None:
+        """
+        adds the conv grid of image i to the stack of its size, and its descriptor to self.descs
+        """
+        if im.ret_size() not in self.buckets:
+            # most sizes hold one or two images, so a bucket starts with room for one grid and doubles from there
+            pyr = signature.pyramid(conv)
+            self.buckets[im.ret_size()] = (signature.GridStack(np.shape(conv), np.float32, 1, self.budget), {},
+                                           signature.GridStack(pyr.shape, np.float64, 1, self.budget))
+        stack, where, pyrs = self.buckets[im.ret_size()]
+        where[i] = stack.add(conv)
+        pyrs.add(signature.pyramid(conv))
+        self.desc_at[i] = self.descs.add(signature.descriptor(conv))
+
+    def region_add(self, i: int, rgs: list[region.Region]) -> None:
+        """
+        adds the regions of image i to self.regions, without their cells
+        """
+        packed = region.RegionSet.of(rgs)
+        start = self.regions.extend(packed.rows)
+        self.region_at[i] = (packed.dims, start, start + len(packed))
+        if "grid" in self.cascade.stages:
+            self.coarse_at[i] = self.coarse.add(Cascade.coarse(rgs))
+
+    def regions_of(self, i: int) -> region.RegionSet:
+        dims, start, stop = self.region_at[i]
+        return region.RegionSet(dims, self.regions.ret_stack()[start:stop])
+
+    def coarse_of(self, i: int) -> np.ndarray | None:
+        return self.coarse.ret_stack()[self.coarse_at[i]] if i in self.coarse_at else None
+
+    def stash(self, i: int, im: File, sig) -> None:
+        """
+        moves the signature of image i into the typed stacks, which hold it from now on
+        """
+        if self.mode == "F":
+            self.bucket_add(i, im, sig)
+        else:
+            self.region_add(i, sig)
+
+    def compare_all(self, i: int, cands: list[int], images: list[File], sigs: list) -> list[tuple]:
+        """
+        compares image i with every candidate k (k being the earlier image, conv1 of fast_find) \n
+        in fast mode, same-size candidates are scored in one pass over their bucket, with the early exit
+        of early_scores, and the others in one pass over their descriptors. In accurate mode, the cascade runs
+        first. Either way a pair dropped early gets the bound of its score found instead of the score
+
+        :returns (k, is duplicate, score) for every candidate, in the order of cands
+        """
+        if self.mode != "F":
+            rgs, grid = self.regions_of(i), self.coarse_of(i)
+            res = []
+            for k in cands:
+                rgs_k = self.regions_of(k)
+                stage, bound = self.cascade.check(rgs_k, rgs, self.coarse_of(k), grid)
+                if stage is not None:
+                    self.metrics.count("pruned_" + stage)
+                    res.append((k, False, bound))
+                else:
+                    self.metrics.count("accurate")
+                    res.append((k,) + self.compare(images[k], images[i], rgs_k, rgs))
+            return res
+
+        stack, where, pyrs = self.buckets[images[i].ret_size()]
+        same = [n for n in range(len(cands)) if cands[n] in where]
+        other = [n for n in range(len(cands)) if cands[n] not in where]
+        scores = np.empty(len(cands))
+        if len(same) > 0:
+            # the grid of image i is read back from its bucket, sigs[i] is only held while i is processed
+            rows = [where[cands[n]] for n in same]
+            grid = stack.ret_stack()[where[i]]
+            scores[same], stages = self.folder.early_scores(stack.ret_stack()[rows], grid, self.max_diff,
+                                                            pyrs.ret_stack()[rows], pyrs.ret_stack()[where[i]])
+            sizes = signature.levels(grid.shape)
+            for stage, n in zip(*np.unique(stages[stages >= 0], return_counts = True)):
+                self.metrics.count(f"pruned_{sizes[stage]}x{sizes[stage]}" if stage < len(sizes) else "pruned_rows", int(n))
+        if len(other) > 0:
+            descs = self.descs.ret_stack()
+            scores[other] = self.folder.descriptor_scores(descs[[self.desc_at[cands[n]] for n in other]], descs[[self.desc_at[i]]])[:, 0]
+        return [(k, bool(scores[n] < self.max_diff), float(scores[n])) for n, k in enumerate(cands)]
+
+    def review(self, keep: File, dup: File, score: float, exact: bool = False) -> bool:
+        """
+        asks the user whether dup is a duplicate of keep, dup is deleted if so \n
+        exact is set when both files are byte-identical
+
+        :returns true if dup was confirmed as a duplicate
+        """
+        self.ui.comp_wind(keep, dup)
+        confirmed = self.ui.action_id == 1
+        self.ui.reset_id()
+        if confirmed:
+            os.remove(dup.ret_name())
+        return confirmed
+
+    def fail(self, msg: str) -> None:
+        ct.windll.user32.MessageBoxW(0, msg, "Error", 0)
+        exit()
+
+    def check_roots(self) -> None:
+        if self.folder.ret_roots() == []:
+            self.fail("No directory specified !")
+        for root in self.folder.ret_roots():
+            if not os.path.isdir(root):
+                self.fail(f"{root} is not a directory")
+
+    def reset(self) -> None:
+        """
+        clears the comparison state before a run
+        """
+        self.images: list[File] = []
+        self.sigs = []
+        self.hashes: list[int | None] = []
+        self.scanned = 0
+        # signatures live in typed stacks sharing one memory budget : conv grids by image size
+        # and their descriptors in fast mode, region rows in accurate mode
+        self.budget = signature.Budget(self.memory, self.spill_dir)
+        self.buckets = {}
+        self.descs = signature.GridStack((signature.DESC_SIZE,), np.float32, budget = self.budget)
+        # position in self.descs of every image whose grid was added
+        self.desc_at = {}
+        self.regions = signature.GridStack((region.RegionSet.WIDTH,), np.float32, 256, self.budget)
+        # (dims, first row, last row + 1) in self.regions of every image whose regions were added
+        self.region_at = {}
+        # coarse grids of the region colours, for the "grid" stage of the cascade only
+        self.coarse = signature.GridStack((COARSE, COARSE, 3), np.float32, budget = self.budget)
+        self.coarse_at = {}
+        self.index = hashindex.MultiIndex(hashindex.DEFAULT_DIST if self.hash_dist is None else self.hash_dist)
+        # the representatives of the groups found, the only images later ones are compared with
+        self.kept: list[int] = []
+        self.clusters = Clusters()
+        self.exact = exact.ExactIndex()
+        # images of a previous run whose signature is only read when they are a candidate
+        self.pending: set[int] = set()
 
     def run(self):
         self.get_path()
-        self.folder.get_content()
-        self.folder.det_images()
-        total = self.progression()
-        compt = 1
-        if self.folder.ret_images() == []:
-            ct.windll.user32.MessageBoxW(0, "No images found in the given folder !", "Error", 0)
-            exit()
-        images = self.folder.ret_images()
-
-        if (self.mode == "F"):
-            convs = [self.folder.convolution(im, 4) for im in images]
+        self.check_roots()
+        self.reset()
+
+        # the scan is consumed lazily : byte-identical copies are settled on the way without decoding,
+        # then every image is compared with the earlier images still kept,
+        # either all of them or only its neighbours in the hash index
+        # the total for the ETA comes from a cheaper walk of the same folders, in the background
+        threading.Thread(target = self.count_total, daemon = True).start()
+        files = self.metrics.timed_iter("enumerate", self.folder.scan())
+        self.drive(lambda: self.search(files))
+
+        self.metrics.total = self.scanned
+        self.metrics.finish()
+        if self.scanned == 0:
+            self.fail("No images found in the given folder !")
+
+    def update(self, state: IndexState) -> None:
+        """
+        incremental run against the result of the previous ones recorded in state \n
+        only new or modified images are decoded and compared, with the images kept so far,
+        and files that disappeared are dropped from state. The folders are listed again to find the changes,
+        but the signatures of unchanged images are only read when they are a comparison candidate.
+        """
+        self.get_path()
+        self.check_roots()
+        self.reset()
+        self.state = state
+        kind, _ = self.signature_kind()
+        known = state.files(kind, self.folder.ret_roots())
+
+        # absolute path -> every image listed
+        seen, changed = {}, []
+        for im in self.metrics.timed_iter("enumerate", self.folder.scan()):
+            path = os.path.abspath(im.ret_name())
+            seen[path] = im
+            row = known.get(path)
+            if row is None or row[0] != im.ret_stat().st_size or row[1] != im.ret_stat().st_mtime_ns or row[2] is None and row[3]:
+                changed.append(path)
+            elif row[3]:
+                self.restore(im, row[2])
+        # the duplicates of a kept file gone or modified go through the search again, in scan order
+        again = set(changed + state.remove(kind, [path for path in known if path not in seen] + changed))
+        files = [seen[path] for path in seen if path in again]
+        # the groups of the previous runs carry on, new duplicates join them
+        for group in state.groups(kind):
+            for dup in group[1:]:
+                if group[0] in seen and dup in seen:
+                    self.clusters.union(seen[group[0]].ret_name(), seen[dup].ret_name())
+
+        # counters add up over the updates of a watch
+        self.metrics.total = self.metrics.ret_count("images") + len(files)
+        self.drive(lambda: self.search(files))
+        state.flush()
+        self.metrics.finish()
+
+    def drive(self, job) -> None:
+        """
+        runs job, the search over the files of a run \n
+        extension point for front-ends that have to keep their own loop going meanwhile
+        """
+        job()
+
+    def search(self, files) -> None:
+        for im, sig in self.signed(self.unique(files)):
+            self.process(im, sig)
+
+    def restore(self, im: File, h: int) -> None:
+        """
+        registers an image kept by a previous run, without reading it
+        """
+        i = len(self.images)
+        self.images.append(im)
+        self.sigs.append(None)
+        self.hashes.append(h)
+        self.pending.add(i)
+        self.index.add(h, i)
+        self.kept.append(i)
+        self.exact.known(im.ret_name(), im.ret_stat().st_size)
+
+    def load(self, k: int) -> bool:
+        """
+        reads the signature of image k if it was restored from a previous run, from the cache when possible
+
+        :returns false if the image can no longer be read, it is then dropped from the index
+        and from the exact copies index, later files of its size no longer hash it
+        """
+        if k not in self.pending:
+            return True
+        self.pending.discard(k)
+        im = self.images[k]
+        try:
+            sig = self.signature(im)
+        except (OSError, UnidentifiedImageError):
+            self.index.remove(self.hashes[k], k)
+            self.kept.remove(k)
+            self.exact.remove(im.ret_name(), im.ret_stat().st_size)
+            return False
+        self.stash(k, im, sig)
+        return True
+
+    def process(self, im: File, sig) -> None:
+        """
+        compares a new image with the images kept so far, and keeps it unless it was confirmed as a duplicate
+        """
+        i = len(self.images)
+        self.images.append(im)
+        self.sigs.append(sig)
+        self.hashes.append(None)
+        self.stash(i, im, sig)
+        if not im.exists():
+            self.metrics.count("images")
+            return
+        with self.metrics.timer("compare"):
+            h = self.phash(sig)
+            self.hashes[i] = h
+            cands = self.kept if self.hash_dist is None else sorted(self.index.query(h, self.hash_dist))
+            cands = [k for k in cands if self.load(k)]
+            found = self.compare_all(i, cands, self.images, self.sigs)
+        self.metrics.count("comparisons", len(cands))
+
+        confirmed = self.confirm(i, [(k, score) for k, is_dup, score in found if is_dup])
+        removed = confirmed is not None
+        if removed:
+            k, score = confirmed
+            self.metrics.count("removed")
+            self.clusters.union(self.images[k].ret_name(), im.ret_name())
+            self.record_pair(self.images[k].ret_name(), im.ret_name(), score)
         else:
-            regions = [self.region_det(im.ret_name()) for im in images]
-
-        while len(images) != 0:
-            if images[0].exists():
-                dups = []
-                dups_ind = []
-                for i in range(1, len(images)):
-                    print("treating comparison " + f"{compt}" + " out of a maximum of " + f"{total}")
-                    if self.mode == "F" and self.folder.fast_find(conv1 = convs[0], conv2 = convs[i], img1 = images[0], img2 = images[i]):
-                        dups.append(images[i])
-                    if self.mode == "A":
-                        score = self.folder.accurate_find(rgs1 = regions[0], rgs2 = regions[i])
-                        if score > -1.0:
-                            dups.append(images[i])
-                            dups_ind.append(i)
-                    compt += 1
-
-                if len(dups) != 0:
-                    for j in range(len(dups)):
-                        self.ui.comp_wind(images[0].ret_name(), dups[j].ret_name())
-                        if self.ui.action_id == 1:
-                            os.remove(dups[j].ret_name())
-                            images.pop(dups_ind[j])
-                            regions.pop(dups_ind[j])
-                            self.ui.reset_id()
-            images.pop(0)
-            regions.pop(0)
\ No newline at end of file
+            self.index.add(h, i)
+            self.kept.append(i)
+        self.record(im, h, not removed)
+        self.sigs[i] = None
+        self.metrics.count("images")
+        self.metrics.progress()
+
+    def confirm(self, i: int, matches: list[tuple]) -> tuple | None:
+        """
+        reviews the matches (k, score) of image i in order, until one of them is confirmed
+
+        :returns the (k, score) confirmed, None if there is none
+        """
+        for k, score in matches:
+            self.metrics.count("matches")
+            with self.metrics.timer("review"):
+                if self.review(self.images[k], self.images[i], score):
+                    return k, score
+        return None
+
+    def groups(self) -> list[list[str]]:
+        """
+        :returns the groups of duplicates confirmed, the file kept first
+        """
+        return self.clusters.groups()
+
+    def record(self, im: File, h: int | None, kept: bool) -> None:
+        if self.state is not None:
+            try:
+                self.state.put(self.signature_kind()[0], im.ret_name(), im.ret_stat(), h, kept)
+            except OSError:
+                pass
+
+    def record_pair(self, keep: str, dup: str, score: float) -> None:
+        if self.state is not None:
+            self.state.pair(self.signature_kind()[0], keep, dup, score)
+
+    def count_total(self) -> None:
+        try:
+            self.metrics.total = Folder(self.folder.ret_roots()).count()
+        except OSError:
+            pass
+
+def extract_signature(name: str, mode: str, reduced: bool = False):
+    """
+    process pool entry point, computes the signature of one image \n
+    only plain arrays cross the process boundary :
+    the conv grid in fast mode, the (labels, avgs) pair of Region.to_labels in accurate mode
+
+    :returns (signature, header of the image as File.ret_header, seconds spent decoding, seconds spent in total)
+    """
+    start = time.perf_counter()
+    app = RunApp(mode, reduced = reduced)
+    app.folder = Folder()
+    img = File(name)
+    if mode == "F":
+        res = app.folder.convolution(img, 4, reduced)
+    else:
+        rgs = app.region_det(img)
+        res = region.Region.to_labels(rgs, (rgs[0].dims[1], rgs[0].dims[0]))
+    return res, img.ret_header(), img.ret_decode_time(), time.perf_counter() - start